@@ -43,22 +43,34 @@ Windows:
 """
 
 import os
+import re
+import concurrent.futures
 import dateutil
-import json
+import itertools
+import pandas as pd
 
-from .utils import (listdir2,
+from .utils import (listdir2_iter,
                     to_datetime,
+                    to_utc,
+                    parse_datetime,
                     check_file_exists,
+                    list_cached,
                     read_file,
                     reformat_sectionals_list,
                     export_sectionals_to_xls,
                     export_sectionals_to_csv,
                     read_url,
+                    json_loads,
                     load_file,
                     alter_sectionals_gate_label,
                     process_url_response,
                     apply_thread_pool,
-                    route_xml_to_json)
+                    apply_thread_pool_iter,
+                    new_session,
+                    prefetch_files,
+                    route_xml_to_json,
+                    zstandard,
+                    SECTIONAL_FIELDS)
 from datetime import datetime, timedelta, timezone
 from datetime import date as date_
 
@@ -74,15 +86,53 @@ os.environ['PERFORMANCE_PATH'] = '/path/to/tracker-performance' #internal
 os.environ['ROUTE_PATH'] = '/path/to/routes'
 os.environ['JUMPS_PATH'] = '/path/to/jumps'
 os.environ['GMAXLICENCE'] = 'my_licence'
+os.environ['CACHE_CODEC'] = 'zstd' # optional, compress per race feed caches
 """
 
 from .. import get_logger
 logger = get_logger(name = __name__)
 
+API_ROOT = "https://www.gmaxequine.com/TPD/client/"
+
 # some courses use metric units for sectional "G" field and needs to be changed
 # from "200m" to "1f" to pass through other sorts and parsers.
 METRIC_GATES = {"65", "66", "67", "68", "31"}
 
+# RaceType of races with obstacles, for which the jumps feed is available
+_JUMP_RE = re.compile(r"hurdle|chase|nh flat", re.IGNORECASE)
+
+# the sectionals-modified feed is one small request per 6 day window, so a
+# multi-year range can use more threads than the per-race feeds without
+# adding noticeable load to the server. still kept under the 20 thread cap
+# enforced by apply_thread_pool.
+MODIFIED_MAX_THREADS = 12
+
+# fewest sharecodes for get_data to list the cache directories up front, 
+# listing a directory of a few hundred thousand files takes longer than 
+# checking a handful of files one by one
+CACHE_SNAPSHOT_MIN = 1000
+
+
+def _imperial_gates(sharecode: str, data: list) -> list:
+    """
+    single call site for the METRIC_GATES check shared by the sectionals 
+    feeds, relabels the gates of metric courses to imperial in place.
+
+    Parameters
+    ----------
+    sharecode : str
+        Gmax/TPD sharecode/race_id.
+    data : list
+        list of gmax sectionals, or None/empty if not found.
+
+    Returns
+    -------
+    list
+    """
+    if data and sharecode[:2] in METRIC_GATES:
+        data = alter_sectionals_gate_label(sectionals = data)
+    return data
+
 
 class RaceMetadata:
     """
@@ -200,8 +250,7 @@ class RaceMetadata:
         if data is None:
             if direc is None:
                 return
-            files = listdir2(direc)
-            for file in files:
+            for file in listdir2_iter(direc):
                 d = read_file(os.path.join(direc, file))
                 for sc in d:
                     self._data[sc] = d[sc]
@@ -247,14 +296,14 @@ class RaceMetadata:
         """
         output = {}
         if countries:
-            output['countries'] = set([sc.get('Country') for sc in self._data.values()])
+            output['countries'] = {sc.get('Country') for sc in self._data.values()}
         if courses:
-            output['courses'] = set([sc.get('Racecourse') for sc in self._data.values()])
+            output['courses'] = {sc.get('Racecourse') for sc in self._data.values()}
         if course_codes:
             # assume first two chars are the course code, might change in later years
-            output['course_codes'] = set([sc[:2] for sc in self._data])
+            output['course_codes'] = {sc[:2] for sc in self._data}
         if race_types:
-            output['race_types'] = set([sc.get('RaceType') for sc in self._data.values()])
+            output['race_types'] = {sc.get('RaceType') for sc in self._data.values()}
         return output
     
     def apply_filter(self,
@@ -306,6 +355,42 @@ class RaceMetadata:
         data : list or dict, optional
             metadata records to import and filter. The default is None.
         """
+        for _ in self.iter_filtered(
+                countries = countries,
+                courses = courses,
+                course_codes = course_codes,
+                published = published,
+                start_date = start_date,
+                end_date = end_date,
+                race_types = race_types,
+                data = data
+                ):
+            pass
+    
+    def iter_filtered(self,
+                      countries: list or set = None,
+                      courses: list or set = None,
+                      course_codes: list or set = None,
+                      published: bool = None,
+                      start_date: datetime or str = None,
+                      end_date: datetime or str = None,
+                      race_types: list or set = None,
+                      data: list or dict = None
+                      ):
+        """
+        generator version of apply_filter, yields (sharecode, metadata) for
+        each race which passes the filter in a single pass over self._data,
+        so callers don't have to iterate the filtered races a second time.
+        
+        self._list is filled as the races are yielded, so is only complete 
+        once the generator is exhausted.
+        
+        takes the same parameters as apply_filter.
+
+        Yields
+        ------
+        tuple of (str, dict)
+        """
         if data is not None:
             self.import_data(data = data)
         countries = countries or self._filter.get('countries')
@@ -321,34 +406,36 @@ class RaceMetadata:
             end_date or self._filter.get('end_date'),
             tz = dateutil.tz.UTC
             )
-        if all([x is None for x in [countries, courses, course_codes, published, start_date, end_date, race_types]]):
+        if all(x is None for x in [countries, courses, course_codes, published, start_date, end_date, race_types]):
             self._list = self._data
-        else:
-            self._list = {}
-            for sc, row in self._data.items():
-                if race_types is not None:
-                    if row['RaceType'] not in race_types:
-                        continue
-                if countries is not None:
-                    if row['Country'] not in countries:
-                        continue
-                if courses is not None:
-                    if row['Racecourse'] not in courses:
-                        continue
-                if course_codes is not None:
-                    if sc[:2] not in course_codes:
-                        continue
-                if published is not None:
-                    if row['Published'] != published:
-                        continue
-                parsed_date = dateutil.parser.parse(row['PostTime'])
-                if start_date is not None:
-                    if parsed_date < start_date:
-                        continue
-                if end_date is not None:
-                    if parsed_date > end_date:
-                        continue
-                self._list[sc] = row
+            yield from self._data.items()
+            return
+        self._list = {}
+        for sc, row in self._data.items():
+            if race_types is not None:
+                if row['RaceType'] not in race_types:
+                    continue
+            if countries is not None:
+                if row['Country'] not in countries:
+                    continue
+            if courses is not None:
+                if row['Racecourse'] not in courses:
+                    continue
+            if course_codes is not None:
+                if sc[:2] not in course_codes:
+                    continue
+            if published is not None:
+                if row['Published'] != published:
+                    continue
+            parsed_date = parse_datetime(row['PostTime'])
+            if start_date is not None:
+                if parsed_date < start_date:
+                    continue
+            if end_date is not None:
+                if parsed_date > end_date:
+                    continue
+            self._list[sc] = row
+            yield sc, row
 
 
 class GmaxFeed:
@@ -369,7 +456,8 @@ class GmaxFeed:
                  sectionals_history_path: str = None,
                  sectionals_raw_path: str = None,
                  jumps_path: str = None,
-                 performance_path: str = None) -> None:
+                 performance_path: str = None,
+                 cache_codec: str = None) -> None:
         """
         instantiate GmaxFeed object to manage downloads and cached file fetching.
 
@@ -398,6 +486,10 @@ class GmaxFeed:
             path to jumps/obstacles directory cache. The default is None.
         performance_path : str, optional
             path to performance directory cache. The default is None.
+        cache_codec : str, optional
+            "zstd" to store newly downloaded per-race feeds zstd compressed,
+            needs the zstandard package. Files are read back either way.
+            The default is None, or the CACHE_CODEC environment variable.
 
         Raises
         ------
@@ -405,6 +497,11 @@ class GmaxFeed:
             if no Gmax/TPD licence is set manually or via environment vars.
         """
         self.licence = licence
+        self._urls = {}
+        # shared by the threads in apply_thread_pool, pool sized to the 
+        # thread limit there so connections are kept alive between requests
+        self._session = new_session()
+        self.set_cache_codec(codec = cache_codec)
         self.set_fixtures_path(path = fixtures_path)
         self.set_racelist_path(path = racelist_path)
         self.set_gps_path(path = gps_path)
@@ -436,10 +533,113 @@ class GmaxFeed:
         if licence is not None:
             os.environ["GMAXLICENCE"] = licence
     
+    def _url(self, endpoint: str, param: str, licence: str = None) -> str:
+        """
+        base url for the given API endpoint with the licence already in the
+        query string, so only the value for param has to be appended to it.
+        
+        built once per endpoint and licence, the licence is part of the key
+        in case it's changed through the licence setter.
+
+        Parameters
+        ----------
+        endpoint : str
+            name of the .ashx endpoint, such as "sectionals".
+        param : str
+            name of the query parameter appended last, such as "Sharecode".
+        licence : str, optional
+            licence to use in place of self.licence. The default is None.
+
+        Returns
+        -------
+        str
+        """
+        licence = licence or self.licence
+        key = (endpoint, param, licence)
+        url = self._urls.get(key)
+        if url is None:
+            url = self._urls[key] = "{0}{1}.ashx?k={2}&{3}=".format(
+                API_ROOT, endpoint, licence, param
+                )
+        return url
+    
     def _confirm_exists(self, path: str) -> bool:
         if not os.path.exists(path):
             os.mkdir(path)
     
+    def _cache_snapshot(self, labels: set = None) -> dict:
+        """
+        list the cache directory of each of the given get_data labels once,
+        for passing to the get_* functions as the 'cached' kwarg so they can
+        skip probing the filesystem for every sharecode.
+
+        Parameters
+        ----------
+        labels : set, optional
+            get_data labels to list. The default is None, for all of them.
+
+        Returns
+        -------
+        dict
+            label -> set of cached file names.
+        """
+        return {
+            label: list_cached(path) for label, path in self._feed_paths().items()
+            if labels is None or label in labels
+            }
+    
+    def _feed_paths(self) -> dict:
+        """
+        map of the per-race feed labels used in get_data to the cache
+        directory for that feed.
+        """
+        return {
+            "sectionals": self._sectionals_path,
+            "sectionals-raw": self._sectionals_raw_path,
+            "sectionals-history": self._sectionals_history_path,
+            "points": self._gps_path,
+            "obstacles": self._jumps_path,
+            "performance": self._errors_path
+            }
+    
+    def iter_cached(self, label: str, sharecodes) -> iter:
+        """
+        stream the cached files of one of the per-race feeds for the given 
+        sharecodes, offline, as get_points/get_sectionals etc would load them.
+        
+        the files are read ahead on a thread pool by prefetch_files, so each
+        is decoded while the next are still being read, rather than one 
+        get_* call per sharecode.
+
+        Parameters
+        ----------
+        label : str
+            get_data label of the feed, eg "points" or "sectionals".
+        sharecodes : iterable
+            Gmax/TPD sharecodes/race_ids.
+
+        Yields
+        ------
+        tuple of (str, list or None)
+            sharecode and its data, None if it isn't cached.
+        """
+        direc = self._feed_paths()[label]
+        sharecodes = list(sharecodes)
+        paths = (os.path.join(direc, sc) for sc in sharecodes)
+        for sc, (_, txt) in zip(sharecodes, prefetch_files(paths)):
+            data = json_loads(txt) if txt else None
+            if label.startswith("sectionals"):
+                data = _imperial_gates(sc, data)
+            yield sc, data
+    
+    def set_cache_codec(self, codec: str = None) -> None:
+        self._cache_codec = codec or os.environ.get('CACHE_CODEC') or None
+        if self._cache_codec == "zstd" and zstandard is None:
+            logger.warning(
+                "zstandard not installed, caching uncompressed files instead"
+                )
+            self._cache_codec = None
+    
     def set_fixtures_path(self, path: str = None) -> None:
         self._fixtures_path = path or os.environ.get('FIXTURES_PATH') or 'fixtures'
         self._confirm_exists(self._fixtures_path)
@@ -528,14 +728,13 @@ class GmaxFeed:
                     return data
         # if data is None file doesn't exist, try downloading a new file if offline is False
         if not offline:
-            url = 'https://www.gmaxequine.com/TPD/client/fixtures.ashx?DateLocal={0}&k={1}'.format(
-                date_str, self.licence
-                )
+            url = self._url("fixtures", "DateLocal") + date_str
             data = process_url_response(
                 url = url,
                 direc = self._fixtures_path,
                 fname = date_str,
-                version = 1
+                version = 1,
+                session = self._session
                 ) or False
         if no_return:
             data = None
@@ -596,13 +795,13 @@ class GmaxFeed:
                     return data.get(sharecode) or False
         # if data is None file doesn't exist, try downloading a new file if offline is False
         if not offline:
-            url = 'https://www.gmaxequine.com/TPD/client/racelist.ashx?Sharecode={0}&k={1}'.format(
-                sharecode, self.licence
-                )
+            url = self._url("racelist", "Sharecode") + sharecode
             # returns a list of 1 dict or empty list - process manually here as don't want to cache just one race
-            txt = read_url(url)
+            # to file, but the response is kept briefly in memory, eg for the
+            # several feeds of a race each looking up its metadata, unless new
+            txt = read_url(url, session = self._session, cache = not new)
             if txt:
-                data = {row['I']:row for row in json.loads(txt)}
+                data = {row['I']:row for row in json_loads(txt)}
         return data.get(sharecode) or False
     
     def get_racelist(self,
@@ -665,15 +864,14 @@ class GmaxFeed:
                         return data
         # if data is None file doesn't exist, try downloading a new file if offline is False
         if not offline:
-            url = 'https://www.gmaxequine.com/TPD/client/racelist.ashx?DateLocal={0}&k={1}'.format(
-                date, self.licence
-                )
+            url = self._url("racelist", "DateLocal") + date
             # returns a list of dicts
             data = process_url_response(
                 url = url,
                 direc = self._racelist_path,
                 fname = date,
-                version = 2
+                version = 2,
+                session = self._session
                 )
         if sharecode is not None:
             return data.get(sharecode) or False
@@ -755,6 +953,9 @@ class GmaxFeed:
         no_return : bool, optional
             return None from target funcs, save memory when just updating files.
             The default is False.
+        cached : dict, optional
+            label -> set of cached file names, see get_data.
+            The default is None.
 
         Returns
         -------
@@ -768,22 +969,23 @@ class GmaxFeed:
             if no_return:
                 data = check_file_exists(
                     direc = self._gps_path,
-                    fname = sharecode
+                    fname = sharecode,
+                    cached = (kwargs.get("cached") or {}).get("points")
                     )
             else:
                 data = load_file(direc = self._gps_path, fname = sharecode)
             if data is not None:
                 return {'sc': sharecode, 'data': data}
         if not offline:
-            url = 'https://www.gmaxequine.com/TPD/client/points.ashx?Sharecode={0}&k={1}'.format(
-                sharecode, self.licence
-                )
+            url = self._url("points", "Sharecode") + sharecode
             # returns rows of dicts delimited by newline characters, r"\r\n", readlines() issue blank final element of list
             data = process_url_response(
                 url = url,
                 direc = self._gps_path,
                 fname = sharecode,
-                version = 3
+                version = 3,
+                session = self._session,
+                codec = self._cache_codec
                 )
         if no_return:
             data = None
@@ -808,6 +1010,9 @@ class GmaxFeed:
         no_return : bool, optional
             return None from target funcs, save memory when just updating files.
             The default is False.
+        cached : dict, optional
+            label -> set of cached file names, see get_data.
+            The default is None.
 
         Returns
         -------
@@ -821,30 +1026,29 @@ class GmaxFeed:
             if no_return:
                 data = check_file_exists(
                     direc = self._sectionals_path,
-                    fname = sharecode
+                    fname = sharecode,
+                    cached = (kwargs.get("cached") or {}).get("sectionals")
                     )
             else:
                 data = load_file(direc = self._sectionals_path, fname = sharecode)
             if data is not None:
-                if not no_return and sharecode[:2] in METRIC_GATES:
-                    data = alter_sectionals_gate_label(sectionals = data)
+                if not no_return:
+                    data = _imperial_gates(sharecode, data)
                 return {'sc': sharecode, 'data': data}
         if not offline:
-            url = 'https://www.gmaxequine.com/TPD/client/sectionals.ashx?Sharecode={0}&k={1}'.format(
-                sharecode, self.licence
-                )
+            url = self._url("sectionals", "Sharecode") + sharecode
             # returns a list of dicts
             data = process_url_response(
                 url = url,
                 direc = self._sectionals_path,
                 fname = sharecode,
-                version = 1
+                version = 1,
+                session = self._session,
+                codec = self._cache_codec
                 )
         if no_return:
-            data = None
-        if data and sharecode[:2] in METRIC_GATES:
-            data = alter_sectionals_gate_label(sectionals = data)
-        return {'sc': sharecode, 'data': data}
+            return {'sc': sharecode, 'data': None}
+        return {'sc': sharecode, 'data': _imperial_gates(sharecode, data)}
     
     def get_sectionals_history(self, sharecode: str, **kwargs) -> dict:
         """
@@ -865,6 +1069,9 @@ class GmaxFeed:
         no_return : bool, optional
             return None from target funcs, save memory when just updating files.
             The default is False.
+        cached : dict, optional
+            label -> set of cached file names, see get_data.
+            The default is None.
 
         Returns
         -------
@@ -878,7 +1085,8 @@ class GmaxFeed:
             if no_return:
                 data = check_file_exists(
                     direc = self._sectionals_history_path,
-                    fname = sharecode
+                    fname = sharecode,
+                    cached = (kwargs.get("cached") or {}).get("sectionals-history")
                     )
             else:
                 data = load_file(
@@ -886,25 +1094,70 @@ class GmaxFeed:
                     fname = sharecode
                     )
             if data is not None:
-                if not no_return and sharecode[:2] in METRIC_GATES:
-                    data = alter_sectionals_gate_label(sectionals = data)
+                if not no_return:
+                    data = _imperial_gates(sharecode, data)
                 return {'sc': sharecode, 'data': data}
         if not offline:
-            url = 'https://www.gmaxequine.com/TPD/client/sectionals-history.ashx?Sharecode={0}&k={1}'.format(
-                sharecode, self.licence
-                )
+            url = self._url("sectionals-history", "Sharecode") + sharecode
             # returns a list of dicts
             data = process_url_response(
                 url = url,
                 direc = self._sectionals_history_path,
                 fname = sharecode,
-                version = 1
+                version = 1,
+                session = self._session,
+                codec = self._cache_codec
                 )
         if no_return:
-            data = None
-        if data and sharecode[:2] in METRIC_GATES:
-            data = alter_sectionals_gate_label(sectionals = data)
-        return {'sc': sharecode, 'data': data}
+            return {'sc': sharecode, 'data': None}
+        return {'sc': sharecode, 'data': _imperial_gates(sharecode, data)}
+    
+    def get_sectionals_by_date(self,
+                               date: str or datetime = None,
+                               **kwargs
+                               ) -> dict:
+        """
+        get post race sectionals for all published races on the given date.
+        
+        the API has no multi-race sectionals endpoint, so the day's races
+        are found from the racelist and fetched one request per race over
+        the shared session, which keeps its connections alive so the TLS 
+        handshake is only paid once per thread rather than once per race.
+
+        Parameters
+        ----------
+        date : str or datetime, optional
+            date for which to fetch sectionals, format is %Y-%m-%d.
+            The default is None, for today.
+        
+        **params
+        new : bool, optional
+            whether to force download a new file.
+            The default is False.
+        offline : bool, optional
+            whether to treat request without internet connection.
+            The default is False.
+        max_threads : int, optional
+            Maximum number of threads to use in threadpool.
+            The default is MAX_THREADS.
+
+        Returns
+        -------
+        dict
+            map of sharecode to sectionals.
+        """
+        racelist = self.get_racelist(
+            date = date,
+            new = kwargs.get("new"),
+            offline = kwargs.get("offline")
+            )
+        if not racelist:
+            return {}
+        return self.get_data(
+            sharecodes = racelist,
+            request = {'sectionals'},
+            **kwargs
+            ).get('sectionals', {})
     
     def get_sectionals_raw(self, sharecode: str, **kwargs) -> dict:
         """
@@ -927,6 +1180,9 @@ class GmaxFeed:
         no_return : bool, optional
             return None from target funcs, save memory when just updating files.
             The default is False.
+        cached : dict, optional
+            label -> set of cached file names, see get_data.
+            The default is None.
 
         Returns
         -------
@@ -944,7 +1200,8 @@ class GmaxFeed:
             if no_return:
                 data = check_file_exists(
                     direc = self._sectionals_raw_path,
-                    fname = sharecode
+                    fname = sharecode,
+                    cached = (kwargs.get("cached") or {}).get("sectionals-raw")
                     )
             else:
                 data = load_file(
@@ -952,26 +1209,23 @@ class GmaxFeed:
                     fname = sharecode
                     )
             if data is not None:
-                if not no_return and sharecode[:2] in METRIC_GATES:
-                    data = alter_sectionals_gate_label(sectionals = data)
+                if not no_return:
+                    data = _imperial_gates(sharecode, data)
                 return {'sc': sharecode, 'data': data}
         if not offline:
-            url = 'https://www.gmaxequine.com/TPD/client/sectionals-raw.ashx?Sharecode={0}&k={1}'.format(
-                sharecode,
-                licence
-                )
+            url = self._url("sectionals-raw", "Sharecode", licence = licence) + sharecode
             # returns a list of dicts
             data = process_url_response(
                 url = url,
                 direc = self._sectionals_raw_path,
                 fname = sharecode,
-                version = 1
+                version = 1,
+                session = self._session,
+                codec = self._cache_codec
                 )
         if no_return:
-            data = None
-        if data and sharecode[:2] in METRIC_GATES:
-            data = alter_sectionals_gate_label(sectionals = data)
-        return {'sc': sharecode, 'data': data}
+            return {'sc': sharecode, 'data': None}
+        return {'sc': sharecode, 'data': _imperial_gates(sharecode, data)}
     
     def get_sectionals_modified(self,
                                 dt: str or datetime,
@@ -1015,18 +1269,17 @@ class GmaxFeed:
         dict - map of sharecode to it's modified timestamp and published status
         """
         data = {}
-        if type(dt) is str:
-            dt = dateutil.parser.parse(dt)
+        dt = to_utc(dt)
         datestring = dt.strftime("%Y-%m-%dT%H:%M:%SZ")
-        url = 'https://www.gmaxequine.com/TPD/client/sectionals-modified.ashx?DateFrom={0}&k={1}'.format(
-            datestring, self.licence
-            )
-        txt = read_url(url)
+        url = self._url("sectionals-modified", "DateFrom") + datestring
+        txt = read_url(url, session = self._session)
         if txt:
-            data = json.loads(txt)
-            for row in data:
-                row["Modified"] = dateutil.parser.parse(row["Modified"])
-            data = {row["I"] : row for row in data}
+            # the fast ISO 8601 parser of parse_datetime rather than 
+            # dateutil.parser.parse per row, copes with the fractional 
+            # seconds coming and going between rows
+            for row in json_loads(txt):
+                row["Modified"] = to_utc(row["Modified"])
+                data[row["I"]] = row
         return data
 
     def get_sectionals_modified_range(self,
@@ -1048,32 +1301,32 @@ class GmaxFeed:
         -------
         dict - map of sharecode to it's modified timestamp and published status
         """
-        max_threads = kwargs.get("max_threads")
+        max_threads = kwargs.get("max_threads") or MODIFIED_MAX_THREADS
         if start_date is None:
-            start_date = datetime(2016, 1, 1)
+            start_date = datetime(2016, 1, 1, tzinfo = timezone.utc)
         else:
-            start_date = to_datetime(start_date)
+            start_date = to_utc(start_date)
         if end_date is None:
-            end_date = datetime.utcnow()
+            end_date = datetime.now(tz = timezone.utc)
         else:
-            end_date = to_datetime(end_date)
+            end_date = to_utc(end_date)
         if end_date < start_date:
             end_date = start_date
-        range_ = (end_date - start_date).days
-        dates = [
-            start_date + timedelta(days = dt) for dt in range(0, range_, 6)
-            ]
-        dates.append(end_date)
+        dates = pd.date_range(
+            start_date,
+            end_date,
+            freq = "6D"
+            ).to_pydatetime().tolist()
+        if dates[-1] != end_date:
+            dates.append(end_date)
         results = apply_thread_pool(
             self.get_sectionals_modified,
             dates,
             max_threads = max_threads
             )
-        data = {}
-        for result in results:
-            if result:
-                data.update(result)
-        return data
+        return {
+            sc: row for result in results if result for sc, row in result.items()
+            }
 
     def get_tracker_performance(self, sharecode: str, **kwargs) -> dict:
         """
@@ -1108,20 +1361,20 @@ class GmaxFeed:
         data = None
         if not new:
             data = load_file(direc = self._errors_path, fname = sharecode)
-            if data is not None and any([row.get("RX") for row in data]):
+            if data is not None and any(row.get("RX") for row in data):
                 if no_return:
                     data = None
                 return {'sc': sharecode, 'data': data}
         if not offline:
-            url = 'https://www.gmaxequine.com/TPD/client/performance.ashx?Sharecode={0}&k={1}'.format(
-                sharecode, self.licence
-                )
+            url = self._url("performance", "Sharecode") + sharecode
             # returns a list of dicts
             data = process_url_response(
                 url = url,
                 direc = self._errors_path,
                 fname = sharecode,
-                version = 1
+                version = 1,
+                session = self._session,
+                codec = self._cache_codec
                 )
         if no_return:
             data = None
@@ -1153,6 +1406,13 @@ class GmaxFeed:
         metadata : dict, optional
             dict of the race metadata for this race, as returned by
             self.get_race(sharecode)
+        racelist : dict, optional
+            dict of sharecode -> race metadata, as passed to get_data, looked
+            up before falling back to self.get_race(sharecode) so batch calls
+            don't reload the racelist file for every race.
+        cached : dict, optional
+            label -> set of cached file names, see get_data.
+            The default is None.
 
         Returns
         -------
@@ -1162,32 +1422,33 @@ class GmaxFeed:
         offline = kwargs.get("offline")
         no_return = kwargs.get("no_return")
         metadata = kwargs.get("metadata") or \
+            (kwargs.get("racelist") or {}).get(sharecode) or \
             self.get_race(sharecode = sharecode, offline = offline)
         if not metadata or \
-            "RaceType" not in metadata or \
-            not any([x in metadata["RaceType"].lower() for x in ["hurdle", "chase", "nh flat"]]):
+            _JUMP_RE.search(metadata.get("RaceType") or "") is None:
             return {"sc": sharecode, "data": None}
         data = None
         if not new:
             if no_return:
                 data = check_file_exists(
                     direc = self._jumps_path,
-                    fname = sharecode
+                    fname = sharecode,
+                    cached = (kwargs.get("cached") or {}).get("obstacles")
                     )
             else:
                 data = load_file(direc = self._jumps_path, fname = sharecode)
             if data is not None:
                 return {"sc": sharecode, "data": data}
         if not offline:
-            url = "https://www.gmaxequine.com/TPD/client/jumps.ashx?Sharecode={0}&k={1}".format(
-                sharecode, self.licence
-                )
+            url = self._url("jumps", "Sharecode") + sharecode
             # returns a list of dicts
             data = process_url_response(
                 url = url,
                 direc = self._jumps_path,
                 fname = sharecode,
-                version = 1
+                version = 1,
+                session = self._session,
+                codec = self._cache_codec
                 )
         if no_return:
             data = None
@@ -1241,15 +1502,14 @@ class GmaxFeed:
                 output["data"] = data
                 return output
         if not offline:
-            url = 'https://www.gmaxequine.com/TPD/client/routes.ashx?Racecourse={0}&k={1}'.format(
-                course_code, self.licence
-                )
+            url = self._url("routes", "Racecourse") + course_code
             # returns a kml encoded text file
             output["data"] = process_url_response(
                 url = url,
                 direc = self._route_path,
                 fname = fname,
-                version = 4
+                version = 4,
+                session = self._session
                 )
         if no_return:
             data = None
@@ -1281,6 +1541,13 @@ class GmaxFeed:
         no_return : bool, optional
             return None from target funcs, save memory when just updating files.
             The default is False.
+        max_processes : int, optional
+            number of processes used to run processing_function over the 
+            KML files, which is CPU bound. starting the processes costs more 
+            than parsing a handful of courses, so only worth it for many. on
+            platforms which spawn processes (windows, macOS) the calling 
+            script must be guarded by if __name__ == "__main__".
+            The default is 1, processing them in this process.
 
         Returns
         -------
@@ -1293,15 +1560,36 @@ class GmaxFeed:
                 end_date = datetime.today(),
                 offline = True
                 )
-            course_codes = list(set([sc[:2] for sc in sharecodes]))
+            course_codes = list({sc[:2] for sc in sharecodes})
         res = apply_thread_pool(
             func = self.get_route,
             iterable = course_codes,
             **kwargs
             )
+        res = [row for row in res if row["data"]]
+        payloads = [row["data"] for row in res]
+        max_processes = kwargs.get("max_processes") or 1
+        processed = None
+        if max_processes > 1 and len(payloads) > 1:
+            try:
+                with concurrent.futures.ProcessPoolExecutor(
+                        min(max_processes, len(payloads))
+                        ) as pool:
+                    processed = list(pool.map(
+                        processing_function,
+                        payloads,
+                        chunksize = 4
+                        ))
+            except Exception:
+                # processing_function not picklable, or processes unavailable
+                logger.warning(
+                    "process pool failed for get_routes, processing serially",
+                    exc_info = True
+                    )
+        if processed is None:
+            processed = [processing_function(x) for x in payloads]
         return {
-            row["course_code"]: processing_function(row["data"])
-            for row in res if row["data"]
+            row["course_code"]: data for row, data in zip(res, processed)
             }
     
     def get_data(self,
@@ -1355,21 +1643,29 @@ class GmaxFeed:
         max_threads : int, optional
             Maximum number of threads to use in threadpool.
             The default is MAX_THREADS.
+        cached : dict, optional
+            label -> set of cached file names, as from self._cache_snapshot.
+            The default is None, listing the cache directories here for
+            CACHE_SNAPSHOT_MIN or more sharecodes, otherwise checking each
+            sharecode's file.
 
         Returns
         -------
         dict
+            empty if no_return is set.
         """
         output = {}
+        racelist = None
         if type(sharecodes) is dict:
+            # keep the metadata to hand for get_obstacles
+            racelist = sharecodes
             if filter is None:
                 filter = RaceMetadata()
-                if all([x not in request for x in [
-                        'sectionals-raw', 'sectionals-history', 'points', 'obstacles']
+                if all(x not in request for x in [
+                        'sectionals-raw', 'sectionals-history', 'points', 'obstacles'
                         ]):
                     filter.set_filter(published = True)
-            filter.apply_filter(data = sharecodes)
-            sharecodes = list(filter)
+            sharecodes = [sc for sc, _ in filter.iter_filtered(data = sharecodes)]
         elif not sharecodes:
             return output
         labels2func = {
@@ -1380,13 +1676,52 @@ class GmaxFeed:
             "obstacles": self.get_obstacles,
             "performance": self.get_tracker_performance
             }
+        # for many sharecodes list the cache directories once rather than 
+        # probing them for every sharecode, sharecodes without a cached file 
+        # then skip the filesystem checks and go straight to the download
+        if (not kwargs.get("new") and kwargs.get("cached") is None
+                and len(sharecodes) >= CACHE_SNAPSHOT_MIN):
+            kwargs["cached"] = self._cache_snapshot(request)
+        # the get_* functions return no data under no_return, so there's
+        # nothing worth collecting
+        want_output = not kwargs.get("no_return")
         for label, func in labels2func.items():
             if label in request:
+                params = kwargs
+                if label == "obstacles" and racelist is not None:
+                    params = {**kwargs, "racelist": racelist}
+                if kwargs.get("new"):
+                    hits, misses = [], sharecodes
+                elif kwargs.get("cached") is None:
+                    # few sharecodes, the get_* functions check their files
+                    hits, misses = sharecodes, []
+                else:
+                    cached = kwargs["cached"].get(label)
+                    if cached is None:
+                        cached = list_cached(self._feed_paths()[label])
+                    hits = [sc for sc in sharecodes if sc in cached]
+                    misses = [sc for sc in sharecodes if sc not in cached]
+                if not want_output:
+                    # run through without keeping the empty results
+                    for _ in itertools.chain(
+                            apply_thread_pool_iter(func = func, iterable = hits, **params),
+                            apply_thread_pool_iter(
+                                func = func, iterable = misses, **{**params, "new": True}
+                                )
+                            ):
+                        pass
+                    continue
                 result = apply_thread_pool(
                     func = func,
-                    iterable = sharecodes,
-                    **kwargs
+                    iterable = hits,
+                    **params
                     )
+                if misses:
+                    result += apply_thread_pool(
+                        func = func,
+                        iterable = misses,
+                        **{**params, "new": True}
+                        )
                 output[label] = {
                     row['sc']: row['data'] for row in result if row['data']
                     }
@@ -1438,16 +1773,12 @@ class GmaxFeed:
         """
         if start_date is None:
             start_date = datetime.now(tz = timezone.utc) - timedelta(days = 14)
-        elif type(start_date) == str:
-            start_date = dateutil.parser.parse(start_date)
-        if start_date.tzinfo is None or start_date.tzinfo.utcoffset(start_date) is None:
-            start_date = start_date.replace(tzinfo = timezone.utc)
+        else:
+            start_date = to_utc(start_date)
         if end_date is None:
             end_date = datetime.now(tz = timezone.utc) - timedelta(days = 1)
-        elif type(end_date) == str:
-            end_date = dateutil.parser.parse(end_date)
-        if end_date.tzinfo is None or end_date.tzinfo.utcoffset(end_date) is None:
-            end_date = end_date.replace(tzinfo = timezone.utc)
+        else:
+            end_date = to_utc(end_date)
         
         if filter is None:
             filter = RaceMetadata()
@@ -1459,6 +1790,8 @@ class GmaxFeed:
             **kwargs
             )
         kwargs["no_return"] = True
+        if not kwargs.get("new") and len(sharecodes) >= CACHE_SNAPSHOT_MIN:
+            kwargs["cached"] = self._cache_snapshot(request)
         _ = self.get_data(
             sharecodes = sharecodes,
             request = request,
@@ -1517,23 +1850,46 @@ class GmaxFeed:
         if filter is None:
             filter = RaceMetadata()
             filter.set_filter(published = True)
-        filter.apply_filter(data = sharecodes) # apply filter in place
-        # return keys from filter._list, post filtered
-        sharecodes = {sc: filter.get(sc) for sc in filter}
-        sects = self.get_data(
-            sharecodes = sharecodes,
-            request = {'sectionals'}
-            ).get('sectionals')
+        # apply filter in place, collecting the races which pass it
+        sharecodes = dict(filter.iter_filtered(data = sharecodes))
         if to_csv:
-            sectionals = []
-            for s in sects.values():
-                sectionals.extend(s)
+            # fill the cache without holding every race in memory, then
+            # stream the files back, decoding each while the next are read
+            if not kwargs.get("offline"):
+                self.get_data(
+                    sharecodes = list(sharecodes),
+                    request = {'sectionals'},
+                    no_return = True
+                    )
+            # files which don't exist are read as None and skipped below, 
+            # the snapshot only saves trying to read them for a long range
+            cached = None
+            if len(sharecodes) >= CACHE_SNAPSHOT_MIN:
+                cached = self._cache_snapshot({'sectionals'})['sectionals']
+            paths = [
+                os.path.join(self._sectionals_path, sc)
+                for sc in sharecodes if cached is None or sc in cached
+                ]
+            sects = (
+                _imperial_gates(os.path.basename(path), json_loads(txt))
+                for path, txt in prefetch_files(paths) if txt
+                )
+            # fixed columns so the rows stream straight to the file, any key
+            # the feed adds beyond them is left out with a warning
             export_sectionals_to_csv(
-                sectionals = sectionals,
+                sectionals = itertools.chain.from_iterable(
+                    x for x in sects if x
+                    ),
                 fname = fname,
-                compression = compression
+                compression = compression,
+                fieldnames = SECTIONAL_FIELDS,
+                extrasaction = "ignore"
                 )
         else:
+            sects = self.get_data(
+                sharecodes = sharecodes,
+                request = {'sectionals'}
+                ).get('sectionals')
             for sc in sects:
                 sharecodes[sc]['sectionals'] = reformat_sectionals_list(sects[sc])
             data = export_sectionals_to_xls(sharecodes)
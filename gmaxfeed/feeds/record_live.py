@@ -14,11 +14,11 @@ Suggestion for use:
     for another process to handle the logic to decide where the packet should be saved.
     
     Use 2 processes, 1 to listen to updates and 1 to save files.
-    in P1, use 2 threads, 1 for UserTerminate class and 1 for socket.listen() to add packet to queue.
-    in P2, dequeue and save packets
+    in P1, listen on the socket and add each packet to a shared memory ring buffer.
+    in P2, take packets from the ring buffer and save them
     
-    To avoid the port blocking upon exiting the program the UserTerminate class can be used to break the listener loop,
-    and can be improved with the GracefulExit SIGTERM interceptor from utils.
+    To avoid the port blocking upon exiting the program, SIGTERM and SIGINT (ctrl+c) are caught to break the listener 
+    loop and close the socket, see shutdown.
 
 Issues in Practice:
     I've used the above description as the foundation for my recorders for the last year or so and it's never missed a 
@@ -43,12 +43,21 @@ Issues in Practice:
     As such I've written a small but functional listener in Rust to handle it instead. This is included in the repo under directory "rust-listener"
     and includes options to handle the packets into a file structure itself or add the packets to a redis queue for other processes to get.
 
+io_uring:
+    A multishot recvmsg on io_uring with a provided buffer ring would remove the per packet receive syscall altogether, but
+    the standard library has no io_uring bindings and it needs either a C extension or a liburing wrapper, neither of which
+    is a dependency of this package, and is linux 6.0+ only. If the python listener ever needs it, the better place for it
+    is the Rust listener (tokio-uring / io-uring crates), the packets reaching the rest of this module are the same either way.
+
 @author: George Swindells
 @email: george.swindells@totalperformancedata.com
 
 """
-import socket, threading, json, os
+import socket, json, os, platform, re, signal, struct, sys, time
+import ctypes, ctypes.util, errno, logging
 import multiprocessing as mp
+from multiprocessing import shared_memory, connection
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
 _dir = os.path.abspath(os.path.dirname(__file__))
@@ -61,69 +70,765 @@ _par_dir, _ = os.path.split(_dir)
 from .. import get_logger
 logger = get_logger(name = __name__)
 
+PORT = 4629
+# number of listener processes, each with their own socket bound to PORT with
+# SO_REUSEPORT, ring buffer and file management process. the kernel shares 
+# the packets between the sockets by hashing the sender address, so this 
+# only helps when the packets come from more than one source. 
+LISTENERS = int(os.environ.get("TPD_LISTENERS", 1))
+# seconds a listener waits on an idle socket before checking for shutdown
+RECV_TIMEOUT = 1
+# pin each listener and file management process to its own cpu, always done
+# with more than one listener. with TPD_NIC set to the interface the packets 
+# arrive on, the cpus are picked from the NIC's numa node where known
+PIN_CPUS = bool(os.environ.get("TPD_PIN_CPUS")) or LISTENERS > 1
+NIC = os.environ.get("TPD_NIC")
+# SCHED_FIFO priority for the listeners so they preempt file management 
+# during a burst, 0 to leave them with the normal scheduler. needs 
+# CAP_SYS_NICE
+SCHED_FIFO = int(os.environ.get("TPD_SCHED_FIFO", 0))
+# socket receive buffer, the usual default of ~200KB overflows during busy
+# periods with several meetings running. the kernel caps it at
+# net.core.rmem_max unless SO_RCVBUFFORCE is allowed, so raise that to match,
+#   sysctl -w net.core.rmem_max=16777216
+UDP_RCVBUF = int(os.environ.get("TPD_UDP_RCVBUF", 16 * 1024 * 1024))
+# linux only socket options, not all exposed by the socket module
+_LINUX = sys.platform.startswith("linux")
+# windows has no recvmsg, ancillary data, writev or non-blocking pipes, so 
+# packets are read with plain recvfrom and stamped with the time read there
+_RECVMSG = hasattr(socket.socket, "recvmsg")
+_POSIX = os.name == "posix"
+_SO_RCVBUFFORCE = getattr(socket, "SO_RCVBUFFORCE", 33)
+_SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40)
+_SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)
+_SO_BUSY_POLL = getattr(socket, "SO_BUSY_POLL", 46)
+# microseconds for the kernel to busy poll the NIC for packets on a read 
+# before sleeping, cuts the wakeup latency at low packet rates for the cost 
+# of some cpu. off by default, values above net.core.busy_read need 
+# CAP_NET_ADMIN, so raise that to match, and pin the listener to the cpu 
+# handling the NIC's interrupts, see listen
+#   sysctl -w net.core.busy_read=50 net.core.busy_poll=50
+BUSY_POLL = int(os.environ.get("TPD_BUSY_POLL", 0))
+_TIMESPEC = struct.Struct("@qq")
+# ancillary data space for the SO_RXQ_OVFL drop counter and the kernel 
+# receive timestamp
+_ANC_SIZE = socket.CMSG_SPACE(4) + socket.CMSG_SPACE(_TIMESPEC.size) if _RECVMSG else 0
+# most packets taken from the socket per recvmmsg call
+RECV_BATCH = 64
+RECV_SIZE = 4096
+_MSG_WAITFORONE = 0x10000
+_WSAEMSGSIZE = 10040 # windows recvfrom error for a packet longer than the buffer
+
+# slot header of payload length, receive time in ns since epoch, ipv4 address, port
+SLOT_HEADER = struct.Struct("=IQ4sH")
+# listener -> file management ring buffer, 4096 slots of ~4KB absorbs a long 
+# burst. each slot holds a whole RECV_SIZE packet, rounded up to cache lines,
+# longer packets are dropped rather than written cut short
+RING_SLOTS = 4096
+SLOT_SIZE = -(-(RECV_SIZE + SLOT_HEADER.size) // 64) * 64
+MAX_PACKET = RECV_SIZE
+# head and tail counters sit on their own cache lines ahead of the slots
+RING_OFFSET = 128
+# the ring's head and tail are read and written without a lock, relying on 
+# aligned 64 bit stores being atomic and seen in program order by the other
+# process, true of x86-64. elsewhere, eg arm64, they're read and written 
+# under a lock instead, which orders them with the slots like a barrier
+_ORDERED_STORES = platform.machine().lower() in ("x86_64", "amd64")
+# most packets file management takes from the ring at once
+DRAIN_BATCH = 64
+# seconds for the listener to wait before retrying a full ring
+RING_POLL = 0.0005
+# seconds the listener keeps retrying a full ring to tell file management to
+# stop, after which it's assumed to have died and the listener exits anyway
+TERMINATE_TIMEOUT = 5
+# sharecode field of a packet, read straight from the bytes to avoid json 
+# decoding every packet just to find the file it goes in
+_SC_RE = re.compile(rb'"I"\s*:\s*"([^"]+)"')
+# output files are kept open, each file's packets gathered until there are 
+# WRITE_BUFFER bytes or WRITE_IOV pieces (IOV_MAX on linux) waiting and then
+# written with one writev, and everything waiting is written every 
+# FLUSH_INTERVAL seconds so little is lost if the process dies
+WRITE_BUFFER = 64 * 1024
+WRITE_IOV = 1024
+FLUSH_INTERVAL = 0.25
+# most output files held open at once, the least recently written is closed
+# to make room, well under the usual limit of 1024 fds per process
+MAX_OPEN_FILES = int(os.environ.get("TPD_MAX_OPEN_FILES", 256))
+
+
+class PacketRing:
+    """
+    single producer single consumer ring buffer of packets in shared memory,
+    the listener process puts packets and the file management process gets 
+    them, with no locks or pickling in between like a mp.Queue.
+    
+    head and tail are free running 64 bit counters, head only written by the
+    producer and tail only by the consumer. the producer fills a slot before
+    publishing it by advancing head, and the consumer reads a slot before 
+    handing it back by advancing tail. on x86-64 the counters are plain 
+    aligned 64 bit loads and stores, elsewhere they go through lock, see 
+    _ORDERED_STORES.
+    
+    rather than polling an empty ring the consumer sleeps in wait on a pipe,
+    and the producer writes a byte to the pipe after publishing packets, so
+    a quiet ring costs nothing and a packet is picked up straight away. 
+    without non-blocking pipes (windows) the consumer polls every RING_POLL.
+    """
+    
+    def __init__(self, slots: int = RING_SLOTS, name: str = None, doorbell: tuple = None,
+                 lock: mp.Lock = None):
+        self._slots = slots
+        if lock is None and not _ORDERED_STORES:
+            lock = mp.Lock()
+        self._lock = lock
+        if doorbell is None and _POSIX:
+            doorbell = connection.Pipe(duplex = False)
+        self._bell_r, self._bell_w = doorbell or (None, None)
+        if self._bell_w is not None:
+            # a full pipe already has the consumer's attention, never block on it
+            os.set_blocking(self._bell_w.fileno(), False)
+        self._shm = shared_memory.SharedMemory(
+            name = name,
+            create = name is None,
+            size = RING_OFFSET + slots * SLOT_SIZE
+            )
+        self._buf = self._shm.buf
+        self._idx = self._buf[:RING_OFFSET].cast("Q")
+        # address of the block, for the kernel to receive packets straight into
+        self._base = ctypes.addressof(ctypes.c_char.from_buffer(self._buf))
+        self.dropped = 0 # packets dropped by put as the ring was full
+    
+    def __reduce__(self):
+        # attach to the same block when passed to a spawned process
+        doorbell = (self._bell_r, self._bell_w) if self._bell_r is not None else None
+        return (self.__class__, (self._slots, self._shm.name, doorbell, self._lock))
+    
+    def __len__(self) -> int:
+        head, tail = self._indices()
+        return head - tail
+    
+    def _indices(self) -> tuple:
+        """
+        current (head, tail).
+        """
+        if self._lock is None:
+            return self._idx[0], self._idx[8]
+        with self._lock:
+            return self._idx[0], self._idx[8]
+    
+    def _advance(self, i: int, value: int) -> None:
+        """
+        publish a new head (i = 0) or tail (i = 8).
+        """
+        if self._lock is None:
+            self._idx[i] = value
+        else:
+            with self._lock:
+                self._idx[i] = value
+    
+    def _offset(self, n: int) -> int:
+        return RING_OFFSET + (n % self._slots) * SLOT_SIZE
+    
+    def _ring(self) -> None:
+        if self._bell_w is None:
+            return
+        try:
+            os.write(self._bell_w.fileno(), b'\0')
+        except BlockingIOError:
+            pass
+    
+    def put(self, data: bytes, addr: tuple, ts_ns: int) -> bool:
+        """
+        copy the packet into the next free slot, returns False and drops the
+        packet if the ring is full. raises ValueError for packets longer than
+        MAX_PACKET.
+        """
+        n = len(data)
+        if n > MAX_PACKET:
+            raise ValueError("packet of {0} bytes longer than MAX_PACKET".format(n))
+        head, tail = self._indices()
+        if head - tail >= self._slots:
+            self.dropped += 1
+            return False
+        offset = self._offset(head)
+        SLOT_HEADER.pack_into(
+            self._buf, offset, n, ts_ns, socket.inet_aton(addr[0]), addr[1]
+            )
+        start = offset + SLOT_HEADER.size
+        self._buf[start:start + n] = data
+        self._advance(0, head + 1) # publish
+        self._ring()
+        return True
+    
+    def put_many(self, packets: list) -> int:
+        """
+        copy a batch of (data, addr, ts_ns) packets into the ring, publishing
+        them all at once, returns the number put. packets which don't fit are
+        dropped, and raises ValueError for packets longer than MAX_PACKET.
+        """
+        head, tail = self._indices()
+        start_head = head
+        free = self._slots - (head - tail)
+        for data, addr, ts_ns in packets[:free]:
+            n = len(data)
+            if n > MAX_PACKET:
+                raise ValueError("packet of {0} bytes longer than MAX_PACKET".format(n))
+            offset = self._offset(head)
+            SLOT_HEADER.pack_into(
+                self._buf, offset, n, ts_ns, socket.inet_aton(addr[0]), addr[1]
+                )
+            start = offset + SLOT_HEADER.size
+            self._buf[start:start + n] = data
+            head += 1
+        self._advance(0, head) # publish
+        if head != start_head:
+            self._ring()
+        self.dropped += len(packets) - (head - start_head)
+        return head - start_head
+    
+    def reserve(self, count: int) -> list:
+        """
+        addresses of the payload space of up to count free slots, for 
+        packets to be written straight into before calling publish.
+        """
+        head, tail = self._indices()
+        free = min(count, self._slots - (head - tail))
+        return [
+            self._base + self._offset(head + i) + SLOT_HEADER.size for i in range(free)
+            ]
+    
+    def publish(self, headers: list) -> None:
+        """
+        publish the slots from reserve with their payloads written, given 
+        their (length, ts_ns, packed ipv4 address, port) headers in order.
+        """
+        head = self._idx[0] # only written by this process
+        for i, header in enumerate(headers):
+            SLOT_HEADER.pack_into(self._buf, self._offset(head + i), *header)
+        self._advance(0, head + len(headers)) # publish
+        if headers:
+            self._ring()
+    
+    def get_many(self, count: int) -> list:
+        """
+        take up to count of the oldest packets from the ring as a list of 
+        (data, addr, ts_ns), handing their slots back all at once.
+        """
+        head, tail = self._indices()
+        n = min(count, head - tail)
+        packets = []
+        for i in range(n):
+            offset = self._offset(tail + i)
+            length, ts_ns, ip, port = SLOT_HEADER.unpack_from(self._buf, offset)
+            start = offset + SLOT_HEADER.size
+            packets.append(
+                (bytes(self._buf[start:start + length]), (socket.inet_ntoa(ip), port), ts_ns)
+                )
+        self._advance(8, tail + n) # hand the slots back
+        return packets
+    
+    def get(self) -> tuple or None:
+        """
+        take the oldest packet from the ring as (data, addr, ts_ns), or None
+        if the ring is empty.
+        """
+        head, tail = self._indices()
+        if tail == head:
+            return None
+        offset = self._offset(tail)
+        n, ts_ns, ip, port = SLOT_HEADER.unpack_from(self._buf, offset)
+        start = offset + SLOT_HEADER.size
+        data = bytes(self._buf[start:start + n])
+        self._advance(8, tail + 1) # hand the slot back
+        return data, (socket.inet_ntoa(ip), port), ts_ns
+    
+    def wait(self, timeout: float = None) -> None:
+        """
+        block until the ring has packets to get, or timeout seconds pass.
+        """
+        if len(self):
+            return
+        if self._bell_r is None:
+            time.sleep(min(RING_POLL, timeout) if timeout is not None else RING_POLL)
+            return
+        if connection.wait([self._bell_r], timeout):
+            os.read(self._bell_r.fileno(), 4096) # clear the doorbell
+    
+    def close(self, unlink: bool = False) -> None:
+        self._idx.release()
+        self._buf = None
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+        if self._bell_r is not None:
+            self._bell_r.close()
+            self._bell_w.close()
+
 
-# to terminate user can input 't' for a more graceful exit
-class UserTerminate:
+_shutdown = False # set by the signal handler to stop the listener
+
+def shutdown(signum, frame) -> None:
+    """
+    SIGTERM and SIGINT handler for the main process, stops the listener 
+    loop and with it the other processes. only sets a flag, setting the 
+    mp.Event could deadlock if the signal lands while the loop holds its 
+    lock, and the interrupted recvmmsg returns straight away for the loop
+    to see it. also the SIGTERM handler of file management, whose loop 
+    stops at the end of the batch in hand and writes out what's waiting.
+    """
+    global _shutdown
+    _shutdown = True
+
+
+def open_listener_socket(port: int = PORT, reuse_port: bool = False) -> socket.socket:
+    """
+    bind the UDP socket to listen on, with a receive buffer of UDP_RCVBUF 
+    bytes, and on linux have the kernel report the running count of packets
+    it dropped because the buffer was full, see kernel_drops, the time 
+    each packet arrived, see kernel_timestamp, and busy poll for BUSY_POLL
+    microseconds if set.
     
-    def userTerminate(self):
-        while True:
-            inp = input()
-            if inp == "t":
-                self.term = True
-                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as serverSocket:
-                    serverSocket.bind(('127.0.0.1',60000))
-                    data = b'terminate activated'
-                    serverSocket.sendto(data, ('127.0.0.1', 4629))
+    receives time out after RECV_TIMEOUT seconds so an idle listener can 
+    check whether it's been asked to stop, and reuse_port sets SO_REUSEPORT
+    so several listeners can bind to the same port.
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    if _recvmmsg is not None:
+        # set on the socket rather than with s.settimeout, which would make the
+        # socket non-blocking and recvmmsg return straight away
+        s.setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVTIMEO, struct.pack("@ll", RECV_TIMEOUT, 0)
+            )
+    else:
+        s.settimeout(RECV_TIMEOUT)
+    forced = False
+    if _LINUX:
+        try:
+            # ignores net.core.rmem_max, needs CAP_NET_ADMIN
+            s.setsockopt(socket.SOL_SOCKET, _SO_RCVBUFFORCE, UDP_RCVBUF)
+            forced = True
+        except OSError:
+            pass
+    if not forced:
+        try:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF)
+        except OSError:
+            logger.warning("unable to set SO_RCVBUF to {0}".format(UDP_RCVBUF))
+    rcvbuf = s.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    if _LINUX:
+        rcvbuf //= 2 # linux reports double the size set, for bookkeeping
+        s.setsockopt(socket.SOL_SOCKET, _SO_RXQ_OVFL, 1)
+        s.setsockopt(socket.SOL_SOCKET, _SO_TIMESTAMPNS, 1)
+        if BUSY_POLL:
+            try:
+                s.setsockopt(socket.SOL_SOCKET, _SO_BUSY_POLL, BUSY_POLL)
+            except OSError: # kernel without CONFIG_NET_RX_BUSY_POLL, or not permitted
+                logger.warning("unable to set SO_BUSY_POLL to {0}".format(BUSY_POLL))
+    if rcvbuf < UDP_RCVBUF:
+        logger.warning(
+            "socket receive buffer is {0} bytes, less than the {1} asked for, "
+            "raise net.core.rmem_max".format(rcvbuf, UDP_RCVBUF)
+            )
+    s.bind(('', port))
+    return s
+
+def kernel_drops(ancdata: list) -> int or None:
+    """
+    running count of packets dropped by the kernel on the socket, from the 
+    SO_RXQ_OVFL ancillary data returned by recvmsg, None if not present.
+    """
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == _SO_RXQ_OVFL:
+            return int.from_bytes(data[:4], sys.byteorder)
+    return None
+
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+        ]
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _msghdr), ("msg_len", ctypes.c_uint)]
+
+class _sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_ushort),
+        ("sin_addr", ctypes.c_ubyte * 4),
+        ("sin_zero", ctypes.c_ubyte * 8),
+        ]
+
+_CMSG_HEADER = struct.Struct("@Nii") # cmsg_len, cmsg_level, cmsg_type
+
+def _load_recvmmsg():
+    if not _LINUX:
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+        func = libc.recvmmsg
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [
+        ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p
+        ]
+    func.restype = ctypes.c_int
+    return func
+
+_recvmmsg = _load_recvmmsg()
+
+
+class BatchReceiver:
+    """
+    take up to RECV_BATCH packets off the socket per recvmmsg syscall rather 
+    than one recvmsg per packet, with the kernel writing each packet straight
+    into a free slot of the ring so no bytes object is made for it. the 
+    message headers are set up once and reused for every call.
+    
+    falls back to one recvmsg per call, copied into the ring with put_many,
+    where recvmmsg isn't available, or recvfrom where recvmsg isn't either.
+    
+    ctypes releases the GIL for the length of the recvmmsg call, so the 
+    listener only holds it while publishing a batch to the ring.
+    """
+    
+    def __init__(self, sock: socket.socket, batch: int = RECV_BATCH):
+        self._sock = sock
+        self._batch = batch
+        self.dropped = 0 # running count of packets dropped by the kernel
+        if _recvmmsg is None:
+            return
+        self._ctrl = ((ctypes.c_char * _ANC_SIZE) * batch)()
+        self._addrs = (_sockaddr_in * batch)()
+        self._iovs = (_iovec * batch)()
+        self._msgs = (_mmsghdr * batch)()
+        for i in range(batch):
+            self._iovs[i].iov_len = MAX_PACKET
+            hdr = self._msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._addrs[i])
+            hdr.msg_iov = ctypes.pointer(self._iovs[i])
+            hdr.msg_iovlen = 1
+            hdr.msg_control = ctypes.addressof(self._ctrl[i])
+    
+    def _ancdata(self, i: int) -> list:
+        """
+        split the control buffer of message i into recvmsg style ancdata.
+        """
+        ctrl = ctypes.string_at(self._ctrl[i], self._msgs[i].msg_hdr.msg_controllen)
+        ancdata = []
+        offset = 0
+        while offset + _CMSG_HEADER.size <= len(ctrl):
+            length, level, kind = _CMSG_HEADER.unpack_from(ctrl, offset)
+            if length < _CMSG_HEADER.size:
                 break
+            ancdata.append(
+                (level, kind, ctrl[offset + _CMSG_HEADER.size:offset + length])
+                )
+            offset += socket.CMSG_SPACE(length - _CMSG_HEADER.size)
+        return ancdata
+    
+    def _check(self, ancdata: list, length: int) -> bool:
+        """
+        log any new kernel drops, and whether the packet fits in a slot.
+        """
+        drops = kernel_drops(ancdata)
+        if drops is not None and drops != self.dropped:
+            logger.warning("socket dropped {0} packets".format(drops - self.dropped))
+            self.dropped = drops
+        if length > MAX_PACKET:
+            logger.warning("packet of {0} bytes over {1} dropped".format(length, MAX_PACKET))
+            return False
+        return True
+    
+    def recv_into(self, ring: PacketRing) -> int:
+        """
+        wait for at least one packet, then put all of those waiting, up to
+        the batch size, into the ring. returns the number put, 0 if the 
+        socket times out.
         
-    def __init__(self):
-        self.term = False
+        packets are left in the socket buffer while the ring is full. packets
+        longer than MAX_PACKET are dropped, on the recvmmsg path their slots 
+        are published empty for file management to skip.
+        """
+        ts_ns = None # receive time if no kernel timestamp
+        if _recvmmsg is None:
+            try:
+                if _RECVMSG:
+                    data, ancdata, flags, addr = self._sock.recvmsg(RECV_SIZE, _ANC_SIZE)
+                    length = len(data) + 1 if flags & socket.MSG_TRUNC else len(data)
+                else:
+                    # a byte over, so a longer packet shows up as too long
+                    (data, addr), ancdata = self._sock.recvfrom(RECV_SIZE + 1), []
+                    length = len(data)
+            except (socket.timeout, BlockingIOError, InterruptedError): # timed out
+                return 0
+            except OSError as e:
+                if getattr(e, "winerror", None) != _WSAEMSGSIZE:
+                    raise
+                length, ancdata = RECV_SIZE + 1, []
+            ts_ns = time.time_ns()
+            if not self._check(ancdata, length):
+                return 0
+            put = ring.put_many([(data, addr, kernel_timestamp(ancdata) or ts_ns)])
+            if put == 0:
+                logger.warning("ring buffer full, {0} packets dropped".format(ring.dropped))
+            return put
+        slots = ring.reserve(self._batch)
+        if not slots:
+            time.sleep(RING_POLL)
+            return 0
+        for i, address in enumerate(slots):
+            self._iovs[i].iov_base = address
+            # the kernel overwrites these with the lengths used
+            self._msgs[i].msg_hdr.msg_namelen = ctypes.sizeof(_sockaddr_in)
+            self._msgs[i].msg_hdr.msg_controllen = _ANC_SIZE
+        # with MSG_TRUNC msg_len is the full length of a packet cut to fit the slot
+        n = _recvmmsg(
+            self._sock.fileno(), self._msgs, len(slots), _MSG_WAITFORONE | socket.MSG_TRUNC, None
+            )
+        if n < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EINTR, errno.EAGAIN, errno.EWOULDBLOCK): # timed out
+                return 0
+            raise OSError(err, os.strerror(err))
+        headers = []
+        for i in range(n):
+            ancdata = self._ancdata(i)
+            length = self._msgs[i].msg_len
+            if not self._check(ancdata, length):
+                length = 0 # cut short by the slot, published empty
+            ts = kernel_timestamp(ancdata)
+            if ts is None:
+                if ts_ns is None:
+                    ts_ns = time.time_ns()
+                ts = ts_ns
+            addr = self._addrs[i]
+            headers.append((
+                length, ts, bytes(addr.sin_addr), socket.ntohs(addr.sin_port)
+                ))
+        ring.publish(headers)
+        return n
+
 
+def kernel_timestamp(ancdata: list) -> int or None:
+    """
+    time the kernel received the packet in ns since epoch, from the 
+    SO_TIMESTAMPNS ancillary data returned by recvmsg, None if not present.
+    taken when the packet arrives rather than when it's read, so isn't 
+    thrown off by time spent waiting in the socket buffer during a burst.
+    """
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == _SO_TIMESTAMPNS:
+            sec, nsec = _TIMESPEC.unpack_from(data)
+            return sec * 1000000000 + nsec
+    return None
 
-def file_management(q:mp.Queue) -> None: # function for secondary file management process, input of queue
+def _parse_cpulist(cpulist: str) -> set:
+    """
+    cpus in a sysfs cpu list like '0-7,16-23'.
+    """
+    cpus = set()
+    for part in cpulist.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+def pick_cpus(iface: str = NIC) -> list:
+    """
+    cpus to pin the listener and file management processes to, those this 
+    process may run on, narrowed to the numa node of the NIC iface if given
+    and the node is known. empty where affinity isn't supported.
+    """
+    if not hasattr(os, "sched_getaffinity"):
+        return []
+    cpus = sorted(os.sched_getaffinity(0))
+    if iface:
+        try:
+            with open("/sys/class/net/{0}/device/numa_node".format(iface)) as f:
+                node = int(f.read())
+            with open("/sys/devices/system/node/node{0}/cpulist".format(node)) as f:
+                local = _parse_cpulist(f.read())
+        except (OSError, ValueError): # virtual interface, or node -1 for unknown
+            logger.warning("numa node of {0} unknown, using any cpu".format(iface))
+        else:
+            cpus = [cpu for cpu in cpus if cpu in local] or cpus
+    return cpus
+
+def listen(ring:PacketRing, stop:mp.Event, reuse_port:bool = False, cpu:int = None) -> None: # function for the listener, puts every packet received into the ring
+    if mp.parent_process() is not None:
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # stopped by the main process through stop
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    if SCHED_FIFO:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(SCHED_FIFO))
+        except (OSError, AttributeError):
+            logger.warning("unable to set SCHED_FIFO priority {0} for the listener".format(SCHED_FIFO))
+    with open_listener_socket(reuse_port = reuse_port) as s:
+        receiver = BatchReceiver(s)
+        while not (_shutdown or stop.is_set()):
+            # wait for data received...
+            receiver.recv_into(ring)
+    # instruct the file management process to exit also
+    deadline = time.monotonic() + TERMINATE_TIMEOUT
+    while not ring.put(b'terminate activated', ('127.0.0.1', 0), 0):
+        if time.monotonic() > deadline:
+            logger.warning(
+                "ring buffer still full after {0}s, file management not "
+                "told to exit".format(TERMINATE_TIMEOUT)
+                )
+            break
+        time.sleep(RING_POLL)
+        
+
+def file_management(ring:PacketRing) -> None: # function for secondary file management process, input of ring buffer
+    
+    fds = OrderedDict() # sc -> open output file descriptor, least recently written first
+    pending = {} # sc -> timestamp, separator and packet pieces waiting to be written
+    pending_size = {} # sc -> bytes waiting to be written
+    
+    def file_save(data:bytes, tstamp:bytes, sc:str) -> None:
+        if b'\n' in data: # newlines stored as \r\n, as the files used to be written in text mode
+            data = data.replace(b'\n', b'\r\n')
+        bufs = pending.get(sc)
+        if bufs is None:
+            bufs = pending[sc] = []
+        # no concatenating, writev gathers the pieces
+        bufs += (tstamp, b';', data)
+        size = pending_size[sc] = pending_size.get(sc, 0) + len(tstamp) + 1 + len(data)
+        if size >= WRITE_BUFFER or len(bufs) > WRITE_IOV - 3:
+            write_out(sc)
+    
+    def get_fd(sc:str) -> int:
+        fd = fds.get(sc)
+        if fd is not None:
+            fds.move_to_end(sc)
+            return fd
+        if len(fds) >= MAX_OPEN_FILES:
+            os.close(fds.popitem(last = False)[1])
+        fd = fds[sc] = os.open(
+            os.path.join(DIREC, sc), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+            )
+        return fd
     
-    def file_save(data:str, tstamp:str, sc:str) -> None:
-        with open(os.path.join(DIREC, sc), 'a', newline = '\r\n') as wfile:
-            wfile.write(tstamp + ';' + data)
+    def write_out(sc:str) -> None:
+        bufs = pending.pop(sc, None)
+        size = pending_size.pop(sc, 0)
+        if not bufs:
+            return
+        try:
+            fd = get_fd(sc)
+        except (OSError, TypeError, ValueError): # sharecode not usable as a file name
+            logger.exception("unable to open output file {0!r}, {1} packets dropped".format(
+                sc, len(bufs) // 3
+                ))
+            return
+        if _POSIX:
+            written = os.writev(fd, bufs)
+        else:
+            written = os.write(fd, b''.join(bufs))
+        if written < size: # short write, only likely if the disk is full
+            rest = memoryview(b''.join(bufs))[written:]
+            while rest:
+                rest = rest[os.write(fd, rest):]
+    
+    def flush_all() -> None:
+        for sc in list(pending):
+            write_out(sc)
     
-    def deal_with_datagram(data:str, address:str, ts) -> None:
+    def deal_with_datagram(data:bytes, address:str, ts:bytes) -> None:
         try:
-            data2 = json.loads(data)
-        except Exception:
-            logger.exception("Encountered json.loads() error: {0} - {1} - {2} ".format(data, address, ts))
+            match = _SC_RE.search(data)
+            if match is not None:
+                sc = match.group(1).decode('ascii')
+            else: # not in the expected layout, fall back to parsing it
+                sc = json.loads(data)['I']
+        except Exception: # skip the packet, eg non ascii sharecode or not json
+            # only decoded here, for the log message
+            logger.exception("Encountered sharecode error: {0} - {1} - {2} ".format(
+                data.decode('ascii', 'replace'), address, ts.decode('ascii')
+                ))
             return
-        file_save(data = data, tstamp = str(ts), sc = data2['I'])
+        file_save(data = data, tstamp = ts, sc = sc)
             
-    while True:
-        d = q.get() # get data from front of queue, wait indefinitely
-        if d[0] == b'terminate activated':
-            break # if userTerminate activated on concurrent process, put 'terminate' in queue to instruct this process to exit also
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # ctrl+c, left to the main process to stop the listener
+    debug = logger.isEnabledFor(logging.DEBUG)
+    next_flush = time.monotonic() + FLUSH_INTERVAL
+    try:
+        running = True
+        while running and not _shutdown:
+            if time.monotonic() >= next_flush:
+                flush_all()
+                next_flush = time.monotonic() + FLUSH_INTERVAL
+            packets = ring.get_many(DRAIN_BATCH) # get data from front of ring
+            if not packets:
+                # nothing received, sleep until there is or it's time to flush
+                ring.wait(max(next_flush - time.monotonic(), 0))
+                continue
+            for data, address, ts_ns in packets:
+                if data == b'terminate activated':
+                    running = False # the listener has stopped, and put this in the ring to instruct this process to exit also
+                    break
+                if not data: # dropped by the listener as too long, see BatchReceiver
+                    continue
+                # time the listener received the packet, formatted once as bytes, 
+                # always with microseconds unlike str(datetime)
+                tReceived = (datetime(1970, 1, 1) + timedelta(microseconds = ts_ns // 1000)).isoformat(
+                    sep = ' ', timespec = 'microseconds'
+                    ).encode('ascii')
+                if debug:
+                    logger.debug("packet of {0} bytes from {1}".format(len(data), address))
+                # kept as bytes all the way to the file, no decode and encode again
+                deal_with_datagram(data, address, tReceived)
+    finally:
         try:
-            tReceived = datetime.utcnow()
-            print(repr(d[0]))
-            data = d[0].decode('ascii')
-        except Exception: # any exception will only be from decode if some unexpected data is received to port
-            logger.exception(' {0} - {1}'.format(str(d), str(tReceived)))
-            continue
-        
-        deal_with_datagram(data, d[1], tReceived)
+            flush_all()
+        finally:
+            for fd in fds.values():
+                os.close(fd)
+        ring.close()
         
 
 if __name__ == '__main__':
-    q = mp.Queue()
-    p = mp.Process(target = file_management, args = (q,))
-    p.start()
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-        ut = UserTerminate()
-        x = threading.Thread(target = ut.userTerminate)
-        x.start()
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind(('',4629)) #(HOST='', PORT=4629)
-        while True: # could use GracefullExit class from utils here to try to avoid port blocking on shutdown
-            # wait for data received...
-            data, addr = s.recvfrom(4096)
-            q.put((data, addr))
-            if ut.term:
-                print("user terminated...")
-                break
-    
+    stop = mp.Event()
+    reuse_port = LISTENERS > 1
+    # listeners on the first cpus, then file management on the next
+    cpus = pick_cpus() if PIN_CPUS else []
+    rings = [PacketRing() for _ in range(LISTENERS)]
+    writers = [mp.Process(target = file_management, args = (ring,)) for ring in rings]
+    procs = writers + [
+        mp.Process(
+            target = listen,
+            args = (ring, stop, reuse_port, cpus[i % len(cpus)] if cpus else None)
+            )
+        for i, ring in enumerate(rings) if i > 0
+        ]
+    for p in procs:
+        p.start()
+    if cpus:
+        for i, p in enumerate(writers):
+            os.sched_setaffinity(p.pid, {cpus[(LISTENERS + i) % len(cpus)]})
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    listen(rings[0], stop, reuse_port, cpus[0] if cpus else None)
+    stop.set() # the other listeners
+    print("terminated...")
+    for p in procs:
+        p.join()
+    for ring in rings:
+        ring.close(unlink = True)
@@ -9,20 +9,81 @@ Created on Fri Oct 6 2020
 
 import os
 import re
+import bz2
+import csv
+import gzip
 import json
+import lzma
+import math
 import time
 import requests
+import itertools
+import threading
+import functools
+import collections
 import dateutil
 import concurrent
 import concurrent.futures
 import numpy as np
 import pandas as pd
-from copy import deepcopy
-from datetime import datetime, timedelta, date
-import bs4
-from bs4 import BeautifulSoup
-
-MAX_THREADS = 6
+from operator import itemgetter
+from types import MappingProxyType
+from datetime import datetime, timedelta, timezone, date
+from lxml import etree
+
+# ciso8601 is an optional C parser for ISO 8601 strings, otherwise fall back
+# to datetime.fromisoformat which handles the "Z" suffix from python 3.11
+try:
+    from ciso8601 import parse_datetime as _parse_iso
+except ImportError:
+    _parse_iso = datetime.fromisoformat
+
+# orjson is an optional, much faster replacement for the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# zstandard is optional, only needed when caching with cache_codec = "zstd"
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# xlsxwriter is optional, a faster engine than pandas' default for excel exports
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+# numba is optional, compiles the haversine/bearing kernels into ufuncs for
+# array inputs when installed
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# suffix of zstd compressed cache files, the name otherwise matches the plain
+# json file so existing caches keep working alongside compressed ones
+ZSTD_SUFFIX = ".zst"
+ZSTD_LEVEL = 3
+
+# default threads for apply_thread_pool, GMAX_MAX_THREADS to override, up to
+# THREAD_LIMIT
+MAX_THREADS = int(os.environ.get("GMAX_MAX_THREADS", 6))
+# upper limit on max_threads accepted by apply_thread_pool, also the size of
+# the connection pool from new_session so every thread can hold a connection
+THREAD_LIMIT = 20
+
+# responses kept by read_url(cache = True) so a URL asked for twice in a run
+# is only fetched once, bounded by count and by total characters held.
+# off unless asked for, downloads like get_*(new = True) must hit the server
+URL_CACHE_SIZE = int(os.environ.get("GMAX_URL_CACHE_SIZE", 256))
+URL_CACHE_CHARS = int(os.environ.get("GMAX_URL_CACHE_CHARS", 32 << 20))
+URL_CACHE_TTL = float(os.environ.get("GMAX_URL_CACHE_TTL", 60)) # seconds
+
+# page cache hints for the cache file reads, not available on windows/macos
+_HAS_FADVISE = hasattr(os, "posix_fadvise")
 
 from .. import get_logger
 
@@ -81,15 +142,73 @@ SPECIFIC_COURSES = {
     "Newcastle 2M98y NH Flat": "Turf"
     }
 
-GATE_MAP = {
+# columns of the sectionals feed, for export_sectionals_to_csv(fieldnames = ...)
+SECTIONAL_FIELDS = ["I", "G", "L", "S", "R", "D", "N", "B"]
+
+# compression options of export_sectionals_to_csv which are streamed to disk,
+# any other pandas compression option is passed to df.to_csv
+_CSV_OPENERS = {
+    "gzip": lambda path: gzip.open(path, "wt", newline = "", compresslevel = 1),
+    "bz2": lambda path: bz2.open(path, "wt", newline = ""),
+    "xz": lambda path: lzma.open(path, "wt", newline = ""),
+    None: lambda path: open(path, "w", newline = "", buffering = 1 << 20)
+    }
+_CSV_EXTENSIONS = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz", ".zst": "zstd"}
+_CSV_PLAIN = {"", ".csv", ".txt"} # extensions compression = "infer" leaves uncompressed
+if zstandard is not None:
+    _CSV_OPENERS["zstd"] = lambda path: zstandard.open(
+        path, "wt", newline = "", cctx = zstandard.ZstdCompressor(level = ZSTD_LEVEL)
+        )
+
+# 0.5f interval gate labels -> the 1f gate they're grouped into, read only
+GATE_MAP = MappingProxyType({
     'Finish': 'Finish',
     '0.5f': 'Finish',
-    }
-for i in range(2, 72, 2):
-    GATE_MAP["{0}f".format(int(i / 2))] = "{0}f".format(int(i / 2))
-    GATE_MAP["{0}F".format(int(i / 2))] = "{0}F".format(int(i / 2))
-    GATE_MAP["{0}f".format(round((i + 1) / 2, 1))] = "{0}f".format(int(i / 2))
-    GATE_MAP["{0}F".format(round((i + 1) / 2, 1))] = "{0}F".format(int(i / 2))
+    **{
+        "{0}{1}".format(gate, unit): "{0}{1}".format(i, unit)
+        for i in range(1, 36)
+        for gate in (i, i + 0.5)
+        for unit in ("f", "F")
+        }
+    })
+_TARGET_GATES = frozenset(GATE_MAP.values())
+
+# remaining distance cutoffs for the finishing sections, so L is compared
+# directly rather than divided by a furlong each time. 201.16 rather than
+# 201.168 is kept on purpose, it leaves the 2f gate (L = 2 * 201.168) out
+_FINAL_2F = 2. * 201.16
+_FINAL_1_75F = 1.75 * 201.16
+
+def _any_of(words: list, ignore_case: list = ()) -> re.Pattern:
+    """
+    regex searching for any of words, or any of ignore_case in any case, 
+    in one scan rather than a substring test per word. never matches if 
+    there are no words, like any() of an empty list.
+    """
+    pattern = "|".join(
+        [re.escape(w) for w in words] +
+        ["(?i:{0})".format(re.escape(w)) for w in ignore_case]
+        )
+    return re.compile(pattern or "(?!)")
+
+# RaceType and racecourse searches for get_race_details, the course lists are
+# read once here so later changes to them aren't picked up
+_TURF_RE = _any_of(["Turf"], ignore_case = ["hurdle", "chase"])
+_AW_RE = _any_of(
+    ["AW", "PT", "FS"],
+    ignore_case = ["allweather", "all weather", "all-weather", "polytrack", "tapeta", "fibresand"]
+    )
+_TURF_COURSES_RE = _any_of(TURF_COURSES)
+_AW_COURSES_RE = _any_of(AW_COURSES)
+_DIRT_COURSES_RE = _any_of(DIRT_COURSES)
+_TURF_SET = frozenset(TURF_COURSES)
+_AW_SET = frozenset(AW_COURSES)
+_DIRT_SET = frozenset(DIRT_COURSES)
+_STRAIGHT_RE = _any_of(["Straight", "Ascot 1M Flat"])
+_ROUND_RE = _any_of(["Round", "Doncaster 7f213y", "Ascot 7f213y Flat"])
+
+# lanes, run-ups and old versions of a RaceType, see reduce_racetype
+_RACETYPE_RE = re.compile(r"( Lane (\d+(?:\.\d+)?))|\((.*?)\)|(Legacy|legacy|OLD|old)")
 
 
 def listdir2(fol: str) -> list:
@@ -106,8 +225,50 @@ def listdir2(fol: str) -> list:
     list
         list of file names.
     """
-    return [f for f in os.listdir(fol) if not f.startswith('.')]
+    return list(listdir2_iter(fol))
+
+def listdir2_iter(fol: str):
+    """
+    as listdir2, but yields the names as the directory is read, for large 
+    cache directories where the list itself isn't needed.
+
+    Parameters
+    ----------
+    fol : str
+        directory to list.
+
+    Yields
+    ------
+    str
+        file name.
+    """
+    with os.scandir(fol) as entries:
+        for entry in entries:
+            if not entry.name.startswith('.'):
+                yield entry.name
+
+def list_cached(fol: str) -> set:
+    """
+    names of the files cached in fol, with the compression suffix of zstd
+    cached files removed so plain and compressed files both match the name
+    they were cached under.
+
+    Parameters
+    ----------
+    fol : str
+        directory to list.
+
+    Returns
+    -------
+    set
+        set of file names.
+    """
+    n = len(ZSTD_SUFFIX)
+    return {
+        f[:-n] if f.endswith(ZSTD_SUFFIX) else f for f in listdir2_iter(fol)
+        }
 
+@functools.lru_cache(maxsize = 256)
 def _gate_num(x: str) -> float:
     """
     convert Gmax gate label to a float in furlongs from finish, and Finish -> 0.
@@ -156,11 +317,20 @@ def alter_gate_label(gate_label: str,
     """
     if func:
         gate_label = func(gate_label)
+    return _metric_gate_label(gate_label)
+
+@functools.lru_cache(maxsize = 256)
+def _metric_gate_label(gate_label: str) -> str:
+    """
+    conversion for alter_gate_label, cached as there are only so many gate 
+    labels.
+    """
     if gate_label[-1] == "m" and len(gate_label) < 10:
         gate_label = "{0}f".format(float(gate_label.replace('m','')) / 200.)
         gate_label = gate_label.replace(".0", "")
     return gate_label
 
+@functools.lru_cache(maxsize = 4096)
 def reduce_racetype(racetype: str) -> str:
     """
     from a Gmax RaceType in the racelist packet, remove specific lanes and
@@ -183,12 +353,8 @@ def reduce_racetype(racetype: str) -> str:
     str
         a more concise racetype, if too much detail given
     """
-    racetype = re.sub(
-        "( Lane (\d+(?:\.\d+)?))|\((.*?)\)|(Legacy|legacy|OLD|old)",
-        "",
-        racetype
-        )
-    return racetype.strip()
+    # cached, the same few racetypes come up race after race
+    return _RACETYPE_RE.sub("", racetype).strip()
 
 def get_race_details(racetype: str, racecourse: str = None) -> dict:
     """
@@ -208,21 +374,21 @@ def get_race_details(racetype: str, racecourse: str = None) -> dict:
     """
     lower_racetype = racetype.lower()
     surface = None
-    if "Turf" in racetype or any([x in lower_racetype for x in ["hurdle", "chase"]]):
+    if _TURF_RE.search(racetype):
         surface = "Turf"
-    elif any([x in lower_racetype for x in ["allweather", "all weather", "all-weather", "polytrack", "tapeta", "fibresand"]]) or \
-         any([x in racetype for x in ["AW", "PT", "FS"]]):
+    elif _AW_RE.search(racetype):
         surface = "AW"
     elif "Dirt" in racetype:
         surface = "Dirt"
     else:
         # use list of courses which are definitely only one type
         racecourse = racecourse or racetype
-        if any([x in racecourse for x in TURF_COURSES]):
+        # exact course names are a set lookup, before scanning for them
+        if racecourse in _TURF_SET or _TURF_COURSES_RE.search(racecourse):
             surface = "Turf"
-        elif any([x in racecourse for x in AW_COURSES]):
+        elif racecourse in _AW_SET or _AW_COURSES_RE.search(racecourse):
             surface = "AW"
-        elif any([x in racecourse for x in DIRT_COURSES]):
+        elif racecourse in _DIRT_SET or _DIRT_COURSES_RE.search(racecourse):
             surface = "Dirt"
         else:
             surface = SPECIFIC_COURSES.get(racetype)
@@ -236,9 +402,9 @@ def get_race_details(racetype: str, racecourse: str = None) -> dict:
     else:
         obstacle = "Flat"
     
-    if any([x in racetype for x in ["Straight", "Ascot 1M Flat"]]):
+    if _STRAIGHT_RE.search(racetype):
         detail = "STRAIGHT"
-    elif any([x in racetype for x in ["Round", "Doncaster 7f213y", "Ascot 7f213y Flat"]]):
+    elif _ROUND_RE.search(racetype):
         detail = "ROUND"
     else:
         detail = None
@@ -267,7 +433,7 @@ def to_datetime(d: datetime or int or float or str = None, tz = None):
         UTC, tz-naive.
     """
     if type(d) is str:
-        d = dateutil.parser.parse(d)
+        d = parse_datetime(d)
     elif type(d) is date:
         d = datetime.combine(d, datetime.min.time())
     elif type(d) in [float, int]:
@@ -283,6 +449,48 @@ def to_datetime(d: datetime or int or float or str = None, tz = None):
             d = d.astimezone(dateutil.tz.UTC).replace(tzinfo = None)
         return d
 
+def parse_datetime(d: str) -> datetime:
+    """
+    parse a datetime string, using the fast ISO 8601 parser for the format
+    given in the gmax feeds, YYYY-mm-ddTHH:MM:SS.fZ, and falling back to
+    dateutil.parser.parse for anything else.
+
+    Parameters
+    ----------
+    d : str
+        datetime string.
+
+    Returns
+    -------
+    datetime
+        tz-aware if the string has an offset or "Z" suffix, else naive.
+    """
+    try:
+        return _parse_iso(d)
+    except ValueError:
+        return dateutil.parser.parse(d)
+
+def to_utc(d: datetime or str) -> datetime:
+    """
+    parse d if it's a string and return it as a tz-aware UTC datetime, naive
+    datetimes are taken to already be in UTC.
+
+    Parameters
+    ----------
+    d : datetime or str
+        datetime or datetime string.
+
+    Returns
+    -------
+    datetime
+        tz-aware, UTC.
+    """
+    if isinstance(d, str):
+        d = parse_datetime(d)
+    if d.tzinfo is None or d.tzinfo.utcoffset(d) is None:
+        return d.replace(tzinfo = timezone.utc)
+    return d.astimezone(timezone.utc)
+
 def put_datetime(dt: datetime) -> str:
     """
     format datetime to ISO UTC string format as used in the GPS packets.
@@ -299,7 +507,74 @@ def put_datetime(dt: datetime) -> str:
         dt = dt.astimezone(dateutil.tz.UTC)
     return dt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-5] + 'Z'
 
-def check_file_exists(direc: str, fname: str) -> True or None:
+def json_loads(s: str or bytes) -> dict or list:
+    """
+    decode a json string or bytes, using orjson if it's installed.
+    
+    orjson is stricter than the json module, eg it rejects NaN, so anything
+    it can't decode is passed to json.loads before raising.
+
+    Parameters
+    ----------
+    s : str or bytes
+        json encoded string or bytes.
+
+    Returns
+    -------
+    dict or list
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(s)
+
+def _has_nonfinite(data) -> bool:
+    """
+    whether data holds a NaN or infinite float anywhere in its dicts/lists.
+    """
+    if isinstance(data, float):
+        return not math.isfinite(data)
+    if isinstance(data, dict):
+        return any(_has_nonfinite(v) for v in data.values())
+    if isinstance(data, (list, tuple)):
+        return any(_has_nonfinite(v) for v in data)
+    return False
+
+def json_dumps(data: dict or list) -> bytes:
+    """
+    encode data as json bytes, using orjson if it's installed.
+    
+    anything orjson can't encode, eg dicts with non string keys, is passed 
+    to json.dumps instead. so is data with NaN or infinite floats, which 
+    orjson writes as null where json.dumps writes NaN/Infinity, and 
+    json_loads reads them back as floats.
+
+    Parameters
+    ----------
+    data : dict or list
+        json serialisable data.
+
+    Returns
+    -------
+    bytes
+    """
+    if orjson is not None:
+        try:
+            res = orjson.dumps(data)
+        except TypeError: # includes orjson.JSONEncodeError
+            pass
+        else:
+            # non-finite floats come out as null, only look for them if so
+            if b"null" not in res or not _has_nonfinite(data):
+                return res
+    return json.dumps(data).encode("utf-8")
+
+def check_file_exists(direc: str,
+                      fname: str,
+                      cached: set = None
+                      ) -> True or None:
     """
     check if file exists, return True if exists.
     
@@ -315,13 +590,67 @@ def check_file_exists(direc: str, fname: str) -> True or None:
         directory to search for file
     fname : str
         file name.
+    cached : set, optional
+        snapshot of the file names in direc, if given it's checked instead
+        of the filesystem. The default is None.
 
     Returns
     -------
     True or None
     """
+    if cached is not None:
+        return fname in cached or None
     path = os.path.join(direc, fname)
-    return (os.path.exists(path) and os.path.getsize(path) > 2) or None
+    try:
+        # one stat for both, rather than exists then getsize
+        if os.stat(path).st_size > 2:
+            return True
+    except OSError: # missing, as os.path.exists
+        pass
+    return os.path.exists(path + ZSTD_SUFFIX) or None
+
+def _read_bytes(path: str) -> bytes or None:
+    """
+    read the raw contents of path, or None if it doesn't exist.
+    
+    if there's no plain file, a zstd compressed copy at path + ZSTD_SUFFIX
+    is read and decompressed instead.
+    """
+    txt = _read_raw(path)
+    if txt is None and zstandard is not None:
+        txt = _read_raw(path + ZSTD_SUFFIX)
+        if txt is not None:
+            txt = zstandard.ZstdDecompressor().decompress(
+                txt, max_output_size = 1 << 30
+                )
+    return txt
+
+def _read_raw(path: str) -> bytes or None:
+    """
+    read the contents of path as stored, or None if it doesn't exist.
+    
+    where available the kernel is told the whole file is about to be read
+    sequentially, so it's fetched in one go rather than on the first page
+    faults, helps most on spinning disks and networked filesystems.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        size = os.fstat(fd).st_size
+        if _HAS_FADVISE and size:
+            os.posix_fadvise(fd, 0, size, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(fd, 0, size, os.POSIX_FADV_WILLNEED)
+        chunks = []
+        while True:
+            chunk = os.read(fd, max(size, 1 << 16))
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        os.close(fd)
+    return b"".join(chunks)
 
 def read_file(path: str, is_json: bool = True) -> dict or list:
     """
@@ -340,12 +669,14 @@ def read_file(path: str, is_json: bool = True) -> dict or list:
         python json object.
     """
     data = None
-    if os.path.exists(path):
-        with open(path, 'r') as f:
-            if is_json:
-                data = json.load(f)
-            else:
-                data = f.read()
+    if is_json:
+        # read as bytes, the json decoders take bytes directly
+        txt = _read_bytes(path)
+        if txt is not None:
+            data = json_loads(txt)
+    elif os.path.exists(path):
+        with open(path, 'r', encoding = "utf-8") as f:
+            data = f.read()
     return data
 
 def load_file(direc: str, fname: str, is_json: bool = True) -> dict or None:
@@ -371,7 +702,8 @@ def load_file(direc: str, fname: str, is_json: bool = True) -> dict or None:
 
 def dump_file(data: dict or str or bytes,
               direc: str, 
-              fname: str
+              fname: str,
+              codec: str = None
               ) -> None:
     """
     dump json encoded data or raw string into os.path.join(direc, fname).
@@ -384,15 +716,26 @@ def dump_file(data: dict or str or bytes,
         directory to use.
     fname : str
         fname to use within given directory.
+    codec : str, optional
+        "zstd" to write a zstd compressed file to fname + ZSTD_SUFFIX,
+        read back transparently by load_file. The default is None.
     """
     path = os.path.join(direc, fname)
-    with open(path, 'w') as f:
-        if type(data) in [list, dict]:
-            json.dump(data, f)
-        else:
-            if type(data) is bytes:
-                data = data.decode("ascii")
-            f.write(data)
+    if type(data) in [list, dict]:
+        data = json_dumps(data)
+    elif type(data) is str:
+        data = data.encode("utf-8")
+    if codec == "zstd" and zstandard is not None:
+        with open(path + ZSTD_SUFFIX, 'wb') as f:
+            f.write(zstandard.ZstdCompressor(level = ZSTD_LEVEL).compress(data))
+        # plain files are read first, so drop any older plain copy
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return
+    with open(path, 'wb') as f:
+        f.write(data)
 
 def reformat_sectionals_list(data: list) -> dict:
     """
@@ -412,10 +755,10 @@ def reformat_sectionals_list(data: list) -> dict:
     dict
         dict, formatted by runnerid -> gate -> data.
     """
-    runners = sorted(list(set([row['I'] for row in data])))
-    d = {runner:{} for runner in runners}
-    for runner in runners:
-        d[runner] = {row['G']:row for row in data if row['I']==runner}
+    # keys inserted sorted first, then filled in one pass over the data
+    d = {runner:{} for runner in sorted({row['I'] for row in data})}
+    for row in data:
+        d[row['I']][row['G']] = row
     return d
 
 def reformat_gps_list(data: list, by: str = 'T') -> dict:
@@ -447,16 +790,18 @@ def reformat_gps_list(data: list, by: str = 'T') -> dict:
         reformatted dict.
     """
     a = 'I' if by == 'T' else 'T'
-    heads = sorted(list(set([row[by] for row in data])))
-    d = {key:{} for key in heads}
-    for key in heads:
-        d[key] = {row[a]:row for row in data if row[by]==key}
+    # keys inserted sorted first, then filled in one pass over the data
+    d = {key:{} for key in sorted({row[by] for row in data})}
+    for row in data:
+        d[row[by]][row[a]] = row
     return d
 
 def process_url_response(url: str,
                          direc: str,
                          fname: str,
-                         version: int = 1
+                         version: int = 1,
+                         session: requests.Session = None,
+                         codec: str = None
                          ) -> dict:
     """
     little helper function to cut down on repeated code.
@@ -476,34 +821,125 @@ def process_url_response(url: str,
         filename under which to store file.
     version : int, optional
         type of data processing to format the string. The default is 1.
+    session : requests.Session, optional
+        session passed onto read_url. The default is None.
+    codec : str, optional
+        compression codec passed onto dump_file for the json versions.
+        The default is None.
 
     Returns
     -------
     dict
     """
     data = {}
-    txt = read_url(url)
+    txt = read_url(url, session = session)
     if txt:
         if version == 1:
-            data = json.loads(txt)
+            data = json_loads(txt)
             if data:
-                dump_file(data = data, direc = direc, fname = fname)
+                # already valid json, so save the text as given rather than
+                # encoding the decoded data again
+                dump_file(data = txt, direc = direc, fname = fname, codec = codec)
         elif version == 2:
-            data = {row['I']:row for row in json.loads(txt)}
-            dump_file(data = data, direc = direc, fname = fname)
+            data = {row['I']:row for row in json_loads(txt)}
+            dump_file(data = data, direc = direc, fname = fname, codec = codec)
         elif version == 3:
-            data = [json.loads(row) for row in txt.splitlines() if len(row) > 5]
+            data = [json_loads(row) for row in txt.splitlines() if len(row) > 5]
             if data:
-                dump_file(data = data, direc = direc, fname = fname)
+                dump_file(data = data, direc = direc, fname = fname, codec = codec)
         elif version == 4:
             if txt not in ["File not available - please contact us.", "Permission Denied", "{}"]:
                 data = txt
                 dump_file(data = data, direc = direc, fname = fname)
     return data
 
-def read_url(url: str = False, try_limit: int = 3) -> str or False:
+def new_session(pool_maxsize: int = THREAD_LIMIT) -> requests.Session:
+    """
+    requests session with a connection pool big enough for every thread in
+    apply_thread_pool, the default pool of 10 would otherwise discard and 
+    reopen connections when more than 10 threads share the session.
+
+    Parameters
+    ----------
+    pool_maxsize : int, optional
+        connections kept open per host. The default is THREAD_LIMIT.
+
+    Returns
+    -------
+    requests.Session
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections = pool_maxsize,
+        pool_maxsize = pool_maxsize
+        )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+_SESSIONS = {} # pid -> session shared by read_url calls without one
+
+def _shared_session() -> requests.Session:
+    """
+    session for read_url to use when none is given, so connections are kept
+    alive between calls. one per process, as a pooled connection mustn't be
+    used by both sides of a fork.
+    """
+    pid = os.getpid()
+    session = _SESSIONS.get(pid)
+    if session is None:
+        # setdefault so threads racing here end up with the same session
+        session = _SESSIONS.setdefault(pid, new_session())
+    return session
+
+_URL_CACHE = collections.OrderedDict() # url -> (expiry, text), LRU order
+_URL_CACHE_LOCK = threading.Lock()
+_url_cache_chars = 0 # total length of the texts in _URL_CACHE
+
+def _cached_url(url: str) -> str or None:
+    """
+    text read for url within the last URL_CACHE_TTL seconds, else None.
+    """
+    global _url_cache_chars
+    with _URL_CACHE_LOCK:
+        hit = _URL_CACHE.get(url)
+        if hit is None:
+            return None
+        if hit[0] < time.monotonic():
+            del _URL_CACHE[url]
+            _url_cache_chars -= len(hit[1])
+            return None
+        _URL_CACHE.move_to_end(url)
+        return hit[1]
+
+def _cache_url(url: str, txt: str) -> None:
+    """
+    store txt for url, dropping the least recently used beyond URL_CACHE_SIZE
+    entries or URL_CACHE_CHARS in total. texts bigger than that aren't kept.
+    """
+    global _url_cache_chars
+    if len(txt) > URL_CACHE_CHARS:
+        return
+    with _URL_CACHE_LOCK:
+        old = _URL_CACHE.pop(url, None)
+        if old is not None:
+            _url_cache_chars -= len(old[1])
+        _URL_CACHE[url] = (time.monotonic() + URL_CACHE_TTL, txt)
+        _url_cache_chars += len(txt)
+        while len(_URL_CACHE) > URL_CACHE_SIZE or _url_cache_chars > URL_CACHE_CHARS:
+            _, (_, dropped) = _URL_CACHE.popitem(last = False)
+            _url_cache_chars -= len(dropped)
+
+def read_url(url: str = False,
+             try_limit: int = 3,
+             session: requests.Session = None,
+             cache: bool = False
+             ) -> str or False:
     """
     simple read url with GET request.
+    
+    with cache, successful reads are kept for URL_CACHE_TTL seconds, so 
+    repeats of the same URL in a run skip the round trip.
 
     Parameters
     ----------
@@ -511,6 +947,13 @@ def read_url(url: str = False, try_limit: int = 3) -> str or False:
         URL to GET. The default is False.
     try_limit : int, optional
         number of attempts to make before giving up. The default is 3.
+    session : requests.Session, optional
+        session to reuse connections from, as from new_session. 
+        The default is None, using a session shared by the process.
+    cache : bool, optional
+        whether to use and store in the response cache. only for callers 
+        happy with a response up to URL_CACHE_TTL seconds old, downloads to
+        refresh the file cache shouldn't. The default is False.
 
     Returns
     -------
@@ -518,22 +961,78 @@ def read_url(url: str = False, try_limit: int = 3) -> str or False:
     """
     if not url:
         return False
+    cache = cache and URL_CACHE_SIZE > 0
+    if cache:
+        txt = _cached_url(url)
+        if txt is not None:
+            return txt
     txt = False
     idx = 0
     while idx < try_limit:
         try:
-            with requests.Session() as s:
-                response = s.get(url, timeout = 8)
-                txt = response.text
-                if txt == "Permission Denied":
-                    txt = False
+            response = (session or _shared_session()).get(url, timeout = 8)
+            txt = response.text
+            if txt == "Permission Denied":
+                txt = False
             break
         except Exception:
             logger.exception('url error - {0}'.format(url))
             time.sleep(1)
             idx += 1
+    if cache and txt:
+        _cache_url(url, txt)
     return txt
 
+def _thread_count(iterable, **kwargs) -> (int, list):
+    """
+    validated max_threads for apply_thread_pool, and the iterable as a list
+    if it had no length.
+    """
+    max_threads = kwargs.get("max_threads") or MAX_THREADS
+    if type(max_threads) is not int:
+        logger.warning("invalid type for max_threads: {0}".format(max_threads))
+        max_threads = MAX_THREADS
+    if max_threads > THREAD_LIMIT:
+        logger.warning(
+            "max_threads > 10 can cause severe server slowdowns, "
+            "overridden and set to internal MAX_THREADS of {0}".format(MAX_THREADS)
+            )
+        max_threads = MAX_THREADS
+    if not hasattr(iterable, "__len__"):
+        # generators etc, need the length to size the pool
+        iterable = list(iterable)
+    return min([max_threads, len(iterable)]), iterable
+
+def apply_thread_pool_iter(func,
+                           iterable,
+                           **kwargs,
+                           ):
+    """
+    as apply_thread_pool, but yields the results in order as they're ready
+    rather than returning them all at the end, so they needn't all be held
+    in memory, eg for no_return updates.
+
+    Parameters
+    ----------
+    func : function
+        function to apply to each element of the given iterable.
+    iterable : list or dict or set or generator
+        iterable of inputs for the given function.
+        
+    **params, passed onto func, as apply_thread_pool
+
+    Yields
+    ------
+    result of func for each element of iterable
+    """
+    threads, iterable = _thread_count(iterable, **kwargs)
+    call = functools.partial(func, **kwargs)
+    if threads > 1:
+        with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+            yield from pool.map(call, iterable)
+    else:
+        yield from map(call, iterable)
+
 def apply_thread_pool(func,
                       iterable,
                       **kwargs,
@@ -545,7 +1044,7 @@ def apply_thread_pool(func,
     ----------
     func : function
         function to apply to each element of the given iterable.
-    iterable : list or dict or set
+    iterable : list or dict or set or generator
         iterable of inputs for the given function.
         
     **params, passed onto func
@@ -565,26 +1064,45 @@ def apply_thread_pool(func,
     -------
     list
     """
-    max_threads = kwargs.get("max_threads") or MAX_THREADS
-    if type(max_threads) is not int:
-        logger.warning("invalid type for max_threads: {0}".format(max_threads))
-        max_threads = MAX_THREADS
-    if max_threads > 20:
-        logger.warning(
-            "max_threads > 10 can cause severe server slowdowns, "
-            "overridden and set to internal MAX_THREADS of {0}".format(MAX_THREADS)
-            )
-        max_threads = MAX_THREADS
-    threads = min([max_threads, len(iterable)])
-    if threads > 1:
-        with concurrent.futures.ThreadPoolExecutor(threads) as pool:
-            results = [pool.submit(func, x, **kwargs) for x in iterable]
-        results = [res.result() for res in results]
-    elif iterable:
-        results = [func(x, **kwargs) for x in iterable]
-    else:
-        results = []
-    return results
+    return list(apply_thread_pool_iter(func, iterable, **kwargs))
+
+def prefetch_files(paths,
+                   max_workers: int = 8,
+                   readahead: int = 32
+                   ):
+    """
+    read files on a thread pool, yielding their contents in the given order
+    while the reads for the next files are already in flight.
+    
+    at most readahead files are held in memory at once, so the caller can
+    decode each file as it arrives without waiting on the disk, and without
+    loading everything up front.
+
+    Parameters
+    ----------
+    paths : iterable
+        file paths to read.
+    max_workers : int, optional
+        number of reader threads. The default is 8.
+    readahead : int, optional
+        maximum number of reads submitted ahead of the consumer.
+        The default is 32.
+
+    Yields
+    ------
+    tuple of (str, bytes or None)
+        path and its contents, None if the file doesn't exist.
+    """
+    window = collections.deque()
+    paths = iter(paths)
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+        for path in itertools.islice(paths, readahead):
+            window.append((path, pool.submit(_read_bytes, path)))
+        while window:
+            path, future = window.popleft()
+            for nxt in itertools.islice(paths, 1):
+                window.append((nxt, pool.submit(_read_bytes, nxt)))
+            yield path, future.result()
 
 def get_start_finish_timestamps(packets: list) -> dict:
     """
@@ -603,20 +1121,30 @@ def get_start_finish_timestamps(packets: list) -> dict:
         "finish_time": datetime or None
         }
     """
-    start_time = None
-    finish_time = None
+    def start_of(row: dict) -> datetime:
+        return datetime.strptime(
+            row["T"],
+            "%Y-%m-%dT%H:%M:%S.%fZ"
+            ) - timedelta(seconds = row["R"])
+    
+    # only the packets the times are taken from are kept during the scan, 
+    # timestamps are parsed once at the end rather than at every false start
+    start_row = None
+    finish = None # (start packet, race time at finish)
     for row in packets:
-        if row["R"] > 0 and start_time is None:
+        if row["R"] > 0 and start_row is None:
             # new start timestamp detected
-            start_time = datetime.strptime(
-                row["T"],
-                "%Y-%m-%dT%H:%M:%S.%fZ"
-                ) - timedelta(seconds = row["R"])
-        elif start_time is not None and row["R"] == 0:
+            start_row = row
+        elif start_row is not None and row["R"] == 0:
             # likely a false start, reset
-            start_time = None
-        if start_time and row["P"] == 0 and row["R"]:
-            finish_time = start_time + timedelta(seconds = row["R"])
+            start_row = None
+        if start_row is not None and row["P"] == 0 and row["R"]:
+            finish = (start_row, row["R"])
+    start_time = start_of(start_row) if start_row is not None else None
+    finish_time = None
+    if finish is not None:
+        finish_start = start_time if finish[0] is start_row else start_of(finish[0])
+        finish_time = finish_start + timedelta(seconds = finish[1])
     return {
         "start_time": start_time,
         "finish_time": finish_time
@@ -640,11 +1168,10 @@ def get_finish_order(sectionals: list) -> dict:
     runners = {}
     if not sectionals:
         return runners
-    sects = [row for row in sectionals if row["G"] == "Finish"]
     t = 0.
     pos = 1
     counter = 0
-    for row in sorted(sects, key = lambda x: x["R"]):
+    for row in sorted((row for row in sectionals if row["G"] == "Finish"), key = itemgetter("R")):
         counter += 1
         if t < row["R"]:
             pos = counter
@@ -695,29 +1222,34 @@ def convert_sectionals_to_1f(sectionals: list) -> list:
         new sectionals with interval equal to 1f, and the remainder placed
         at the start of the race.
     """
-    new_sects = []
-    runners = set([row["I"] for row in sectionals])
-    all_gates = list(set([row["G"] for row in sectionals]))
+    # gate label -> furlongs from finish, parsed once per label
+    gnum = {g: _gate_num(g) for g in {row["G"] for row in sectionals}}
     fur_gates = sorted(
-        [g for g in all_gates if int(_gate_num(g)) == _gate_num(g)],
-        key = _gate_num,
+        [g for g, n in gnum.items() if int(n) == n],
+        key = gnum.get,
         reverse = True
         )
+    by_runner = {}
+    for row in sectionals:
+        by_runner.setdefault(row["I"], []).append(row)
+    # runner -> whole furlongs from finish -> sectionals within that furlong
+    runner_buckets = {}
+    for runner, runner_sects in by_runner.items():
+        if len({row["G"] for row in runner_sects}) != len(gnum):
+            continue # remove runners where end is cut off (usually tailed off)
+        buckets = collections.defaultdict(list)
+        for row in runner_sects:
+            buckets[int(gnum[row["G"]])].append(row)
+        runner_buckets[runner] = buckets
+    new_sects = []
     for gate in fur_gates:
-        for runner in runners:
-            runner_sects = [row for row in sectionals if row["I"] == runner]
-            runner_gates = set([row["G"] for row in runner_sects])
-            if len(runner_gates) != len(all_gates):
-                continue # remove runners where end is cut off (usually tailed off)
-            gate_number = _gate_num(gate)
-            upper_gate_number = int(gate_number) + 1
-            sects = [row for row in runner_sects if
-                     gate_number <= _gate_num(row["G"]) < upper_gate_number]
+        for buckets in runner_buckets.values():
+            sects = buckets.get(int(gnum[gate]))
             if sects:
-                b = min(sects, key = lambda row: row["L"]).get("B")
+                b = min(sects, key = itemgetter("L")).get("B")
                 d = {
                     "I": sects[0]["I"],
-                    "G": min([row["G"] for row in sects], key = _gate_num),
+                    "G": min([row["G"] for row in sects], key = gnum.get),
                     "L": min([row["L"] for row in sects]),
                     "S": sum([row["S"] for row in sects]),
                     "R": max([row["R"] for row in sects]),
@@ -729,7 +1261,7 @@ def convert_sectionals_to_1f(sectionals: list) -> list:
                 new_sects.append(d)
     # check that the data isn't for a race with weird gates, 7.78f etc. easiest
     # check is at this point the logic above will only have gates for "Finish"
-    if all([row["G"] == "Finish" for row in new_sects]):
+    if all(row["G"] == "Finish" for row in new_sects):
         return []
     return new_sects
 
@@ -775,10 +1307,9 @@ def group_sectionals_to_1f(sectionals: list) -> list:
         at the start of the race.
     """
     given_gates = [row["G"] for row in sectionals]
-    if any([g not in GATE_MAP for g in given_gates]):
+    if any(g not in GATE_MAP for g in given_gates):
         return None
-    target_gates = set([row for row in GATE_MAP.values()])
-    if all([g in target_gates for g in given_gates]):
+    if all(g in _TARGET_GATES for g in given_gates):
         return sectionals
     new_sectionals = []
     # get dict of all runners that finished the race.
@@ -794,15 +1325,28 @@ def group_sectionals_to_1f(sectionals: list) -> list:
     for runner, groups in runners.items():
         for target_gate, sects in groups.items():
             if sects:
-                b = min(sects, key = lambda row: row["L"]).get("B")
+                # one pass over the section's rows for all the sums, in the
+                # same order so the totals are unchanged
+                first = sects[0]
+                s, r, dist, n = first["S"], first["R"], first["D"], first.get("N") or 0
+                nearest = first
+                for row in sects[1:]:
+                    s += row["S"]
+                    dist += row["D"]
+                    n += row.get("N") or 0
+                    if row["R"] > r:
+                        r = row["R"]
+                    if row["L"] < nearest["L"]:
+                        nearest = row
+                b = nearest.get("B")
                 d = {
-                    "I": sects[0]["I"],
+                    "I": first["I"],
                     "G": target_gate,
                     "L": round(_gate_num(target_gate) * 201.168, 1),
-                    "S": round(sum([row["S"] for row in sects]), 2),
-                    "R": max([row["R"] for row in sects]),
-                    "D": round(sum([row["D"] for row in sects]), 1),
-                    "N": round(sum([row.get("N") or 0 for row in sects]), 1)
+                    "S": round(s, 2),
+                    "R": r,
+                    "D": round(dist, 1),
+                    "N": round(n, 1)
                 }
                 if b is not None:
                     d["B"] = b
@@ -831,35 +1375,44 @@ def add_proportions(sectionals: list, inplace: bool = True) -> list:
     list
         sectionals as given, with proportions fields 'prop_S' and 'prop_N' added.
     """
+    # runner -> sections, final time once the Finish is seen, total strides,
+    # number of sections with strides and whether any has no distance, all
+    # gathered in the one pass over the rows
     runners = {}
-    runner_final_times = {}
-    runner_final_strides = {}
     if not inplace:
-        sectionals = deepcopy(sectionals)
+        # records only hold scalars, so copying each dict is a full copy
+        sectionals = [dict(row) for row in sectionals]
     for row in sectionals:
-        if row["I"] not in runners:
-            runners[row["I"]] = []
-            runner_final_strides[row["I"]] = 0
-        runners[row["I"]].append(row)
-        runner_final_strides[row["I"]] += row.get("N", 0)
+        runner = runners.get(row["I"])
+        if runner is None:
+            runner = runners[row["I"]] = {"rows": [], "fs": 0, "n": 0, "no_d": False}
+        runner["rows"].append(row)
+        runner["fs"] += row.get("N", 0)
+        if "N" in row:
+            runner["n"] += 1
         if row["G"] == "Finish":
-            runner_final_times[row["I"]] = row["R"]
-        if row.get("D") and row.get("S"):
-            row["V"] = row["D"] / row["S"]
-            if row.get("N"):
-                row["SF"] = row["N"] / row["S"]
-                row["SL"] = row["D"] / row["N"]
-    for runner, sections in runners.items():
-        if runner not in runner_final_times:
+            runner["ft"] = row["R"]
+        d, s, n = row.get("D"), row.get("S"), row.get("N")
+        if "D" not in row or d == 0:
+            runner["no_d"] = True
+        if d and s:
+            row["V"] = d / s
+            if n:
+                row["SF"] = n / s
+                row["SL"] = d / n
+    for runner in runners.values():
+        if "ft" not in runner:
             continue
-        if 0 < sum(["N" in s for s in sections]) < len(sections):
+        sections = runner["rows"]
+        if 0 < runner["n"] < len(sections):
             continue
-        if any([s.get("D", 0.) == 0 for s in sections]):
+        if runner["no_d"]:
             continue
+        final_time, final_strides = runner["ft"], runner["fs"]
         for section in sections:
-            section["prop_S"] = section["S"] / runner_final_times[runner]
-            if runner_final_strides[runner]:
-                section["prop_N"] = section["N"] / runner_final_strides[runner]
+            section["prop_S"] = section["S"] / final_time
+            if final_strides:
+                section["prop_N"] = section["N"] / final_strides
     return sectionals
 
 def validate_sectionals(data: list,
@@ -893,10 +1446,10 @@ def validate_sectionals(data: list,
     """
     if data:
         if False: #handle_dups:
-            unique_tuples = set([(row["I"], row["G"]) for row in data])
+            unique_tuples = {(row["I"], row["G"]) for row in data}
             if len(unique_tuples) != len(data):
                 logger.warning("Duplicate runner section warning, checking to see which runner and gate...")
-                runners = set([row['I'] for row in data])
+                runners = {row['I'] for row in data}
                 new_data = {}
                 for runner in runners:
                     for row in data:
@@ -924,14 +1477,15 @@ def validate_sectionals(data: list,
             if remove_runners:
                 data = [row for row in data if row["I"] not in remove_runners]
         if remove_incomplete:
-            runners = {row["I"]: [] for row in data}
-            for row in data:
-                runners[row["I"]].append(row)
-            expected_records = np.median([len(r) for r in runners.values()])
+            runners = collections.Counter([row["I"] for row in data])
+            expected_records = np.median(list(runners.values()))
+            remove_runners = set()
             for runner, records in runners.items():
-                if len(records) != expected_records:
+                if records != expected_records:
                     logger.warning("runner {0} found with missing gates, removing from sectionals".format(runner))
-                    data = [row for row in data if row["I"] != runner]
+                    remove_runners.add(runner)
+            if remove_runners:
+                data = [row for row in data if row["I"] not in remove_runners]
     return data
 
 def compute_overall_race_metrics(sectionals: list,
@@ -969,27 +1523,55 @@ def compute_overall_race_metrics(sectionals: list,
     if not sectionals:
         return []
     metrics = []
-    runners = set([row["I"] for row in sectionals])
-    max_gate = max(
-        sectionals,
-        key = lambda row: row["L"]
-        )["G"]
-    min_time = min(
-        [row["R"] for row in sectionals if row["G"] == "Finish"] or [0]
+    # columns as arrays, so the per runner sums are bincounts over the row's
+    # runner index rather than python loops. each row's fields are read once,
+    # with runners and gates numbered in order of first appearance
+    runners = {}
+    gates = {}
+    columns = np.array(
+        [
+            (
+                row["L"],
+                row["R"],
+                row.get("D", 0),
+                row.get("N", 0),
+                row.get("S", 0),
+                runners.setdefault(row["I"], len(runners)),
+                gates.setdefault(row["G"], len(gates))
+                )
+            for row in sectionals
+            ],
+        dtype = float
         )
-    for runner in runners:
-        data = [row for row in sectionals if row["I"] == runner]
-        if ignore_first and len(data) > 1:
-            distance_ran = sum([row.get("D", 0) for row in data if row["G"] != max_gate])
-            number_strides = sum([row.get("N", 0) for row in data if row["G"] != max_gate])
-            time = sum([row.get("S", 0) for row in data if row["G"] != max_gate])
-        else:
-            distance_ran = sum([row.get("D", 0) for row in data])
-            number_strides = sum([row.get("N", 0) for row in data])
-            time = sum([row.get("S", 0) for row in data])
-        finish_time = sum([row.get("R", 0) for row in data if row["G"] == "Finish"]) or None
-        final_2f_time = sum([row.get("S", 0) for row in data if (row["L"] / 201.16) <= 2.])
-        final_2f_distance = sum([row.get("D", 0) for row in data if (row["L"] / 201.16) <= 2.])
+    L, R, D, N, S = columns[:, :5].T
+    idx = columns[:, 5].astype(np.intp)
+    gate = columns[:, 6].astype(np.intp)
+    is_finish = gate == gates.get("Finish", -1)
+    # argmax takes the first of equal values, as max did
+    max_gate = sectionals[int(np.argmax(L))]["G"]
+    min_time = float(R[is_finish].min()) if is_finish.any() else 0
+    not_first = gate != gates[max_gate]
+    final_2f = L <= _FINAL_2F
+    k = len(runners)
+    def runner_sums(values, mask = None):
+        if mask is not None:
+            return np.bincount(idx[mask], weights = values[mask], minlength = k)
+        return np.bincount(idx, weights = values, minlength = k)
+    count = np.bincount(idx, minlength = k)
+    use_rest = (count > 1) if ignore_first else np.zeros(k, dtype = bool)
+    distances = np.where(use_rest, runner_sums(D, not_first), runner_sums(D))
+    strides = np.where(use_rest, runner_sums(N, not_first), runner_sums(N))
+    times = np.where(use_rest, runner_sums(S, not_first), runner_sums(S))
+    finish_times = runner_sums(R, is_finish)
+    final_2f_times = runner_sums(S, final_2f)
+    final_2f_distances = runner_sums(D, final_2f)
+    for runner, i in runners.items():
+        distance_ran = float(distances[i])
+        number_strides = float(strides[i])
+        time = float(times[i])
+        finish_time = float(finish_times[i]) or None
+        final_2f_time = float(final_2f_times[i])
+        final_2f_distance = float(final_2f_distances[i])
         if time > 0 and distance_ran > 0:
             finish_speed_perc = (final_2f_distance / final_2f_time) / (distance_ran / time)
         else:
@@ -1040,7 +1622,7 @@ def estimate_off_time(sharecodes: list, gmax_feed) -> dict:
             output[sc] = None
             continue
         runner_finishes = {
-            row["I"]: dateutil.parser.parse(row['T']) for row in sec_raw
+            row["I"]: parse_datetime(row['T']) for row in sec_raw
             if row["G"] == "Finish"
             }
         runner_times = {
@@ -1051,8 +1633,10 @@ def estimate_off_time(sharecodes: list, gmax_feed) -> dict:
             for k in runner_finishes
             if k in runner_times
             ]
+        # a handful of runners, so plain floats rather than numpy, fsum to
+        # keep the precision on the large timestamps
         st = datetime.utcfromtimestamp(
-            np.mean(offtimes)
+            math.fsum(offtimes) / len(offtimes)
             ).replace(tzinfo = dateutil.tz.UTC) if offtimes else None
         output[sc] = st
     return output
@@ -1074,10 +1658,16 @@ def list_broken_progress_field(sharecodes: list, gmax_feed) -> list:
         list of broken sharecodes
     """
     broken = []
-    for sc in sharecodes:
-        points = gmax_feed.get_points(sc, offline = True).get('data')
+    # the cached files are read ahead in threads while these are checked
+    for sc, points in gmax_feed.iter_cached("points", sharecodes):
         if points:
-            if len(set([row["P"] for row in points])) < 20:
+            # stop counting once there are enough distinct P values
+            seen = set()
+            for row in points:
+                seen.add(row["P"])
+                if len(seen) >= 20:
+                    break
+            else:
                 broken.append(sc)
     return broken
 
@@ -1099,21 +1689,29 @@ def list_broken_sectional_field(sharecodes: list, gmax_feed) -> list:
         list of broken sharecodes
     """
     broken = []
-    for sc in sharecodes:
-        sects = gmax_feed.get_sectionals(sc, offline = True).get('data')
+    # the cached files are read ahead in threads while these are checked
+    for sc, sects in gmax_feed.iter_cached("sectionals", sharecodes):
         if sects:
-            if sum(["B" in row for row in sects]) != len(sects):
+            # stop at the first record missing a field, rather than counting
+            if not all("B" in row and "L" in row and "D" in row for row in sects):
                 broken.append(sc)
-            elif sum(["L" in row for row in sects]) != len(sects):
+            # N is optional, but should be on all the records or none
+            elif any("N" in row for row in sects) and not all("N" in row for row in sects):
                 broken.append(sc)
-            elif sum(["D" in row for row in sects]) != len(sects):
-                broken.append(sc)
-            else:
-                sumn = sum(["N" in row for row in sects])
-                if sumn and sumn != len(sects):
-                    broken.append(sc)
     return broken
 
+def _to_excel(df: pd.DataFrame, fname: str) -> None:
+    """
+    write df to an excel file, with xlsxwriter when it's installed.
+    
+    not in xlsxwriter's constant_memory mode, as pandas writes the cells a 
+    column at a time and that mode only takes them a row at a time.
+    """
+    if xlsxwriter is not None:
+        df.to_excel(fname, engine = "xlsxwriter")
+    else:
+        df.to_excel(fname)
+
 def create_broken_post_race_excel(gmax_feed,
                                   lower_date: datetime = None,
                                   upper_date: datetime = None,
@@ -1158,7 +1756,8 @@ def create_broken_post_race_excel(gmax_feed,
     df.assign(
         I = [str(x).zfill(14) for x in df["I"].to_numpy()]
         )
-    df.to_excel(
+    _to_excel(
+        df,
         "broken_racetypes_{0}.xlsx".format(
             datetime.today().strftime("%Y%d%m")
             )
@@ -1179,18 +1778,25 @@ def _compute_derivatives(data: dict, race_length: float) -> dict:
     -------
     dict
     """
-    average_sl = np.sum((
-        [gate['D'] for gate in data.values()]) / 
-        np.sum([gate['N'] for gate in data.values() if 'N' in gate and gate['D'] > 0]
-        ))
-    average_sf = np.sum([gate['N'] for gate in data.values() if 'N' in gate]) / data['Finish']['R']
-    fin_speed = np.sum((
-        [gate['D'] for gate in data.values() if (gate["L"] / 201.16) <= 1.75]) /
-        np.sum([gate['S'] for gate in data.values() if (gate["L"] / 201.16) <= 1.75]
-        ))
+    # totals in one pass over the gates
+    distance = strides = moving_strides = fin_distance = fin_time = 0.
+    sections = {}
+    for gate in data.values():
+        distance += gate['D']
+        if 'N' in gate:
+            strides += gate['N']
+            if gate['D'] > 0:
+                moving_strides += gate['N']
+        if gate["L"] <= _FINAL_1_75F:
+            fin_distance += gate['D']
+            fin_time += gate['S']
+        sections[gate['G']] = gate
+    # as numpy floats, so a zero total gives inf/nan rather than raising
+    average_sl = np.float64(distance) / moving_strides
+    average_sf = np.float64(strides) / data['Finish']['R']
+    fin_speed = np.float64(fin_distance) / fin_time
     av_speed = race_length / data['Finish']['R'] # some issues with this, can't use actual data['D'] because of opening distance occasionally being 0, and race-length often underestimates the distance like at Fontwell.
     fin_perc = 100 * fin_speed / av_speed
-    sections = {gate['G']:gate for gate in data.values()}
     return {
         'finish_time': data['Finish']['R'],
         'average_sl': average_sl,
@@ -1201,24 +1807,76 @@ def _compute_derivatives(data: dict, race_length: float) -> dict:
 
 def export_sectionals_to_csv(sectionals: dict or list,
                              fname: str = None,
-                             compression: str = None
+                             compression: str = None,
+                             fieldnames: list = None,
+                             extrasaction: str = "raise"
                              ) -> None:
     """
-    export the given dictionary/list of sharecodes to csv format
+    export the given dictionary/list of sharecodes to csv format.
+    
+    rows are written with the csv module rather than through a DataFrame.
+    the columns are every key seen across the rows, in first seen order, 
+    with an index column first, like pd.DataFrame.from_records().to_csv().
+    values are written as given though, so ints in a column with gaps stay
+    ints where pandas would write them as floats.
+    
+    finding the columns needs a pass over all the rows, so pass fieldnames
+    to stream a generator, eg itertools.chain.from_iterable(sects.values()),
+    without holding the whole export in memory.
     
     Parameters
     ----------
-    sectionals : dict
-        dictionary or list of all sectionals to export as given by gmax API.
+    sectionals : dict or list
+        dictionary or iterable of all sectionals to export as given by gmax API.
     fname : str
         name of the file to save under
     compression: str
-        as per options for df.to_csv(compression = compression)
+        as per options for df.to_csv(compression = compression). None, "gzip",
+        "bz2", "xz" and "zstd" (needs zstandard) are streamed, as is "infer" 
+        for a fname ending in one of those or .csv, anything else, eg .zip, 
+        is passed on to pandas.
+    fieldnames: list, optional
+        columns to write, eg SECTIONAL_FIELDS. The default is None, which 
+        uses the union of the keys of all rows.
+    extrasaction: str, optional
+        what to do with keys not in fieldnames, as per csv.DictWriter. 
+        "raise" raises a ValueError, "ignore" leaves them out of the file, 
+        logging a warning the first time each key is seen. 
+        The default is "raise".
     """
     if type(sectionals) is dict:
-        sectionals = [row for row in sectionals.values()]
-    df = pd.DataFrame.from_records(sectionals)
-    df.to_csv(fname or 'tpd_sectionals.csv', compression = compression)
+        sectionals = sectionals.values()
+    fname = fname or 'tpd_sectionals.csv'
+    if compression == "infer":
+        root, ext = os.path.splitext(fname)
+        if ext.lower() in _CSV_PLAIN:
+            compression = None
+        elif ext in _CSV_EXTENSIONS and not root.endswith(".tar"):
+            compression = _CSV_EXTENSIONS[ext]
+        # otherwise left for pandas to infer, eg .zip or .tar.gz
+    if compression not in _CSV_OPENERS:
+        df = pd.DataFrame.from_records(list(sectionals))
+        df.to_csv(fname, compression = compression)
+        return
+    if fieldnames is None:
+        sectionals = list(sectionals)
+        # dict as an ordered set, keeps first seen order like pandas
+        fieldnames = list(dict.fromkeys(k for row in sectionals for k in row))
+    columns = set(fieldnames)
+    with _CSV_OPENERS[compression](fname) as f:
+        if not fieldnames:
+            f.write('""' + os.linesep)
+            return
+        writer = csv.writer(f, lineterminator = os.linesep)
+        writer.writerow([""] + fieldnames)
+        for idx, row in enumerate(sectionals):
+            if not columns.issuperset(row):
+                extra = sorted(set(row) - columns)
+                if extrasaction == "raise":
+                    raise ValueError(f"row {idx} has keys not in fieldnames: {extra}")
+                logger.warning("keys not in fieldnames left out of {0}: {1}".format(fname, extra))
+                columns.update(extra) # only warned once per key
+            writer.writerow([idx] + [row.get(k) for k in fieldnames])
 
 def export_sectionals_to_xls(sharecodes: dict) -> None:
     """
@@ -1244,57 +1902,72 @@ def export_sectionals_to_xls(sharecodes: dict) -> None:
                   }
     """
     data = {}
-    for sc in sorted(list(sharecodes.keys()), key = lambda x: dateutil.parser.parse(sharecodes[x]['PostTime']), reverse=True):
+    # parse each post time once, for the sort and the Date columns
+    post_times = {sc: parse_datetime(sharecodes[sc]['PostTime']) for sc in sharecodes}
+    for sc in sorted(sharecodes, key = post_times.get, reverse=True):
         if 'sectionals' in sharecodes[sc]:
-            for rnum in sharecodes[sc]['sectionals']:
-                derivs = _compute_derivatives(sharecodes[sc]['sectionals'][rnum], race_length = sharecodes[sc]['RaceLength'])
-                data[rnum + '_S'] = {
-                        'Date':dateutil.parser.parse(sharecodes[sc]['PostTime']).strftime('%Y-%m-%d %H:%M:%S'),
+            post_time = post_times[sc].strftime('%Y-%m-%d %H:%M:%S')
+            race_type = sharecodes[sc]['RaceType']
+            race_length = sharecodes[sc]['RaceLength']
+            for rnum, sects in sharecodes[sc]['sectionals'].items():
+                derivs = _compute_derivatives(sects, race_length = race_length)
+                times = {
+                        'Date':post_time,
                         'Sharecode':rnum,
                         'Metric':'Time',
-                        'RaceType':sharecodes[sc]['RaceType'],
-                        'RaceLength':sharecodes[sc]['RaceLength'],
+                        'RaceType':race_type,
+                        'RaceLength':race_length,
                         'Finish Speed Percentage':np.round(derivs['finish_perc'], 2),
                         'Overall':derivs['finish_time'],
                         }
-                data[rnum + '_SL'] = {
-                        'Date':dateutil.parser.parse(sharecodes[sc]['PostTime']).strftime('%Y-%m-%d %H:%M:%S'),
+                stride_lengths = {
+                        'Date':post_time,
                         'Sharecode':rnum,
                         'Metric':'Stride Length',
-                        'RaceType':sharecodes[sc]['RaceType'],
-                        'RaceLength':sharecodes[sc]['RaceLength'],
+                        'RaceType':race_type,
+                        'RaceLength':race_length,
                         'Finish Speed Percentage':None,
                         'Overall':np.round(derivs['average_sl'], 2),
                         }
-                data[rnum + '_SF'] = {
-                        'Date':dateutil.parser.parse(sharecodes[sc]['PostTime']).strftime('%Y-%m-%d %H:%M:%S'),
+                stride_freqs = {
+                        'Date':post_time,
                         'Sharecode':rnum,
                         'Metric':'Stride Frequency',
-                        'RaceType':sharecodes[sc]['RaceType'],
-                        'RaceLength':sharecodes[sc]['RaceLength'],
+                        'RaceType':race_type,
+                        'RaceLength':race_length,
                         'Finish Speed Percentage':None,
                         'Overall':np.round(derivs['average_sf'], 2),
                         }
                 for h in HEADERS_['1']:
-                    if h in sharecodes[sc]['sectionals'][rnum]:
-                        data[rnum + '_S'][h] = sharecodes[sc]['sectionals'][rnum][h]['S']
-                    else:
-                        data[rnum + '_S'][h] = None
-                        data[rnum + '_SL'][h] = None
-                        data[rnum + '_SF'][h] = None
+                    gate = sects.get(h)
+                    if gate is None:
+                        times[h] = None
+                        stride_lengths[h] = None
+                        stride_freqs[h] = None
                         continue
-                    if 'N' in sharecodes[sc]['sectionals'][rnum][h] and sharecodes[sc]['sectionals'][rnum][h]['S'] > 1:
-                        data[rnum + '_SL'][h] = np.round(sharecodes[sc]['sectionals'][rnum][h]['D'] / sharecodes[sc]['sectionals'][rnum][h]['N'], 2)
-                        data[rnum + '_SF'][h] = np.round(sharecodes[sc]['sectionals'][rnum][h]['N'] / sharecodes[sc]['sectionals'][rnum][h]['S'], 2)
+                    times[h] = gate['S']
+                    if 'N' in gate and gate['S'] > 1:
+                        stride_lengths[h] = np.round(gate['D'] / gate['N'], 2)
+                        stride_freqs[h] = np.round(gate['N'] / gate['S'], 2)
                     else:
-                        data[rnum + '_SL'][h] = None
-                        data[rnum + '_SF'][h] = None
+                        stride_lengths[h] = None
+                        stride_freqs[h] = None
+                data[rnum + '_S'] = times
+                data[rnum + '_SL'] = stride_lengths
+                data[rnum + '_SF'] = stride_freqs
                     
-    df = pd.DataFrame.from_dict(data, 'index')
-    df.to_excel('tpd_sectionals.xlsx')
+    # records with an index are quicker to frame than the dict of dicts
+    df = pd.DataFrame.from_records(list(data.values()), index = list(data))
+    _to_excel(df, 'tpd_sectionals.xlsx')
     return data
 
-def route_xml_to_json(x: str or bytes) -> list:
+def _xml_text(element: etree._Element) -> str:
+    """
+    all the text within an element, comments excluded.
+    """
+    return "".join(element.itertext())
+
+def route_xml_to_json(x: str or bytes, as_array: bool = False) -> list:
     """
     convert the Gmax racecourse survey KML file into a nested json dict.
 
@@ -1302,6 +1975,12 @@ def route_xml_to_json(x: str or bytes) -> list:
     ----------
     x : str or bytes
         KML encoded text, bytes, file pointer, or filepath.
+    as_array : bool, optional
+        whether to give each line string's coordinates as an (n, 3) array of
+        X, Y, Z, with their ids in a matching "course_coordinates_id" array,
+        rather than a dict per point. much smaller for large surveys, 
+        route_to_json gives the per point json from either.
+        The default is False.
 
     Returns
     -------
@@ -1333,13 +2012,13 @@ def route_xml_to_json(x: str or bytes) -> list:
         return None
     coords_id = 1
     
-    def _handle_linestrings(placemark: bs4.element.Tag) -> list:
+    def _handle_linestrings(placemark: etree._Element) -> list:
         """
-        handle a placemark tag of LineString tags as bs4 form, convert to json format
+        handle a placemark element of LineString elements, convert to json format
 
         Parameters
         ----------
-        placemark : Tag
+        placemark : etree._Element
 
         Returns
         -------
@@ -1349,11 +2028,11 @@ def route_xml_to_json(x: str or bytes) -> list:
         nonlocal coords_id
         coords_output = []
         # each coordinate line is stored in a LineString tag
-        line_strings = placemark.find_all("LineString")
-        style_name = placemark.find("styleUrl").text
+        line_strings = placemark.iter("{*}LineString")
+        style_name = _xml_text(placemark.find(".//{*}styleUrl"))
         if "#" not in style_name:
             style_name = "#" + style_name
-        placemark_name = placemark.find("name").text
+        placemark_name = _xml_text(placemark.find(".//{*}name"))
         for idx, line_string in enumerate(line_strings, start = 1):
             line_string_dict = {
                 "line_string_id": idx,  # line-string level unique ID
@@ -1361,18 +2040,37 @@ def route_xml_to_json(x: str or bytes) -> list:
                 "style_name": style_name,  # will be useful for filtering coordinate types when have multiple running lines (lanes in USA/CA)
                 "coordinates": []
                 }
-            if line_string.coordinates is not None:
-                coords = line_string.coordinates.text.strip().split()
-                # coords exist as 3d trio including elevation (which is usually 0 or unusably inaccurate)
-                for coord_trio in coords:
-                    X, Y, Z = coord_trio.split(",")
-                    line_string_dict["coordinates"].append({
-                        "X": float(X),  # longitude
-                        "Y": float(Y),  # latitude
-                        "Z": float(Z),  # elevation
-                        "course_coordinates_id": coords_id  # course wide unique ID
-                        })
-                    coords_id += 1
+            coordinates = line_string.find(".//{*}coordinates")
+            if as_array:
+                line_string_dict["coordinates"] = np.empty((0, 3))
+                line_string_dict["course_coordinates_id"] = np.empty(0, dtype = np.int64)
+            if coordinates is not None:
+                coords = _xml_text(coordinates).split()
+                # coords exist as 3d trio including elevation (which is usually 0 or unusably inaccurate),
+                # checked per trio, then converted all in one go and taken back
+                # out three at a time
+                if any(coord.count(",") != 2 for coord in coords):
+                    raise ValueError("coordinates not all X,Y,Z trios in placemark {0}".format(placemark_name))
+                values = list(map(float, ",".join(coords).split(","))) if coords else []
+                if as_array:
+                    line_string_dict["coordinates"] = np.array(values).reshape(-1, 3)
+                    line_string_dict["course_coordinates_id"] = np.arange(
+                        coords_id, coords_id + len(coords), dtype = np.int64
+                        )
+                    coords_id += len(coords)
+                    coords_output.append(line_string_dict)
+                    continue
+                trios = iter(values)
+                line_string_dict["coordinates"] = [
+                    {
+                        "X": X,  # longitude
+                        "Y": Y,  # latitude
+                        "Z": Z,  # elevation
+                        "course_coordinates_id": coords_id + i  # course wide unique ID
+                        }
+                    for i, (X, Y, Z) in enumerate(zip(trios, trios, trios))
+                    ]
+                coords_id += len(coords)
             coords_output.append(line_string_dict)
         return coords_output
     
@@ -1380,17 +2078,26 @@ def route_xml_to_json(x: str or bytes) -> list:
         if len(x) > 256: # probably given the whole file contents
             txt = x
         else: # probably given a filepath
-            with open(x, 'r') as f:
+            with open(x, 'r', encoding = "utf-8") as f:
                 txt = f.read()
     else: # probably given a file points for some reason
         txt = x.read()
-    soup = BeautifulSoup(txt, features = "xml")
+    # lenient like the bs4 xml parser was, and allowing for long coordinates.
+    # a str is already decoded, so ignore any encoding in the xml declaration
+    parser = etree.XMLParser(
+        recover = True,
+        huge_tree = True,
+        encoding = "utf-8" if type(txt) is str else None
+        )
+    if type(txt) is str:
+        txt = txt.encode("utf-8")
+    root = etree.fromstring(txt, parser = parser)
     output = []
-    course_name = soup.find("name").text
+    course_name = _xml_text(root.find(".//{*}name"))
     # each track type is stored under a different "Folder" tag
-    folders = soup.find_all("Folder")
+    folders = root.iter("{*}Folder")
     for folder in folders:
-        track_type_name = folder.find("name").text
+        track_type_name = _xml_text(folder.find(".//{*}name"))
         track_type_output = {
             "course_name": course_name,
             "track_type": track_type_name,
@@ -1401,15 +2108,51 @@ def route_xml_to_json(x: str or bytes) -> list:
                 }
             }
         # WINNING_LINE and RUNNING_LINE are stored in separate Placemark tags
-        placemarks = folder.find_all("Placemark")
+        placemarks = folder.iter("{*}Placemark")
         for placemark in placemarks:
-            style_name = placemark.find("styleUrl").text
+            style_name = _xml_text(placemark.find(".//{*}styleUrl"))
             if "#" not in style_name:
                 style_name = "#" + style_name
             track_type_output["coordinates"][style_name].append(_handle_linestrings(placemark = placemark))
         output.append(track_type_output)
     return output
 
+def route_to_json(routes: list) -> bytes:
+    """
+    encode the output of route_xml_to_json as json bytes, in the dict per
+    point format whether or not it was made with as_array.
+
+    Parameters
+    ----------
+    routes : list
+        as returned by route_xml_to_json.
+
+    Returns
+    -------
+    bytes
+    """
+    def _line_string(line_string: dict) -> dict:
+        coords = line_string["coordinates"]
+        if type(coords) is not np.ndarray:
+            return line_string
+        output = {k: v for k, v in line_string.items() if k != "course_coordinates_id"}
+        output["coordinates"] = [
+            {"X": X, "Y": Y, "Z": Z, "course_coordinates_id": i}
+            for (X, Y, Z), i in zip(coords.tolist(), line_string["course_coordinates_id"].tolist())
+            ]
+        return output
+    
+    return json_dumps([
+        {
+            **track_type,
+            "coordinates": {
+                style_name: [[_line_string(ls) for ls in placemark] for placemark in placemarks]
+                for style_name, placemarks in track_type["coordinates"].items()
+                }
+            }
+        for track_type in routes
+        ])
+
 def last_tracker_use(data: list, fname: str = None) -> pd.DataFrame:
     """
     get date of latest usage of each tracker from performance feed
@@ -1425,23 +2168,80 @@ def last_tracker_use(data: list, fname: str = None) -> pd.DataFrame:
     -------
     pd.DataFrame
     """
-    trackers = {}
+    latest = {} # tracker -> (date, sharecode) of its latest use
     for row in data:
-        date = row["I"][2:14]
-        t1 = row.get("ID1")
-        t2 = row.get("ID2")
-        for t in [t1, t2]:
+        sharecode = row["I"]
+        date = sharecode[2:14]
+        for t in (row.get("ID1"), row.get("ID2")):
             if t and "Unknown" not in t:
-                if t not in trackers:
-                    trackers[t] = {"date": date, "code": t[-3:], "sharecode": row["I"]}
-                else:
-                    if date > trackers[t]["date"]:
-                       trackers[t] = {"date": date, "code": t[-3:], "sharecode": row["I"]}
-    for t in trackers:
-        trackers[t]["date"] = datetime.strptime(trackers[t]["date"], "%Y%m%d%H%M")
+                seen = latest.get(t)
+                if seen is None or date > seen[0]:
+                    latest[t] = (date, sharecode)
+    # only parse the dates that are kept
+    trackers = {
+        t: {"date": datetime.strptime(date, "%Y%m%d%H%M"), "code": t[-3:], "sharecode": sharecode}
+        for t, (date, sharecode) in latest.items()
+        }
     return pd.DataFrame.from_dict(trackers, orient = 'index')
     #df.to_excel(fname or 'latest_tracker_uses.xlsx')
 
+# numbers the geodesy functions below take the scalar math path for
+_SCALAR_TYPES = frozenset({float, int, np.float64, np.float32, np.int64, np.int32})
+_DEG2RAD = math.pi / 180.
+_HALF_DEG2RAD = 0.5 * _DEG2RAD
+
+def _is_scalar(*args) -> bool:
+    """
+    whether all the args are single numbers rather than arrays.
+    """
+    return all(type(arg) in _SCALAR_TYPES for arg in args)
+
+def _haversine_kernel(x1, x2, y1, y2):
+    x1 = math.radians(x1)
+    x2 = math.radians(x2)
+    y1 = math.radians(y1)
+    y2 = math.radians(y2)
+    a = math.sin((y2-y1)*0.5)**2 + math.cos(y1)*math.cos(y2)*math.sin((x2-x1)*0.5)**2
+    return 12730000*math.asin(min(math.sqrt(a), 1.))
+
+def _bearing_kernel(lon1, lat1, lon2, lat2):
+    lon1 = math.radians(lon1)
+    lat1 = math.radians(lat1)
+    lon2 = math.radians(lon2)
+    lat2 = math.radians(lat2)
+    return math.atan2(
+        math.sin(lon2-lon1)*math.cos(lat2),
+        math.cos(lat1)*math.sin(lat2)-math.sin(lat1)*math.cos(lat2)*math.cos(lon2-lon1)
+        )
+
+def _new_lat_kernel(Y1, D, B):
+    Y1 = math.radians(Y1)
+    d = D / 6378100.
+    return math.degrees(math.asin(math.sin(Y1)*math.cos(d) + math.cos(Y1)*math.sin(d)*math.cos(B)))
+
+def _new_lon_kernel(X1, Y1, D, B, Y2):
+    Y1 = math.radians(Y1)
+    Y2 = math.radians(Y2)
+    d = D / 6378100.
+    return X1 + math.degrees(math.atan2(
+        math.sin(B)*math.sin(d)*math.cos(Y1),
+        math.cos(d)-math.sin(Y1)*math.sin(Y2)
+        ))
+
+def _back_bearing_kernel(b):
+    return b + math.pi if b <= 0. else b - math.pi
+
+@functools.lru_cache(maxsize = None)
+def _jit_ufunc(kernel, nargs: int):
+    """
+    kernel compiled by numba into a float64 ufunc on first use, so the whole
+    expression runs in one loop over the arrays. None without numba.
+    """
+    if numba is None:
+        return None
+    signature = "float64({0})".format(", ".join(["float64"] * nargs))
+    return numba.vectorize([signature], cache = True)(kernel)
+
 def haversine(x1: np.ndarray,
               x2: np.ndarray,
               y1: np.ndarray,
@@ -1468,13 +2268,23 @@ def haversine(x1: np.ndarray,
     np.ndarray or float
         haversine distance (meters) between the two given points. 
     """
-    x1 = np.deg2rad(x1)
-    x2 = np.deg2rad(x2)
-    y1 = np.deg2rad(y1)
-    y2 = np.deg2rad(y2)
-    return 12730000*np.arcsin(
-        ((np.sin((y2-y1)*0.5)**2) + np.cos(y1)*np.cos(y2)*np.sin((x2-x1)*0.5)**2)**0.5
-        )
+    if _is_scalar(x1, x2, y1, y2):
+        return _haversine_kernel(x1, x2, y1, y2)
+    ufunc = _jit_ufunc(_haversine_kernel, 4)
+    if ufunc is not None:
+        return ufunc(x1, x2, y1, y2)
+    # degrees to radians folded into the constants, and the squares/products
+    # done in place, to cut down the temporary arrays
+    y1 = np.multiply(y1, _DEG2RAD)
+    y2 = np.multiply(y2, _DEG2RAD)
+    a = np.sin(np.subtract(y2, y1) * 0.5)
+    a *= a
+    b = np.sin(np.subtract(x2, x1) * _HALF_DEG2RAD)
+    b *= b
+    b *= np.cos(y1)
+    b *= np.cos(y2)
+    a += b
+    return 12730000*np.arcsin(np.sqrt(a))
 
 def compute_bearing(coords1: (float, float),
                     coords2: (float, float)
@@ -1494,6 +2304,11 @@ def compute_bearing(coords1: (float, float),
     float
         bearing, clockwise angle in radians from North and direction of travel.
     """
+    if type(coords1) is tuple and type(coords2) is tuple and _is_scalar(*coords1, *coords2):
+        return _bearing_kernel(*coords1, *coords2)
+    ufunc = _jit_ufunc(_bearing_kernel, 4)
+    if ufunc is not None:
+        return ufunc(*coords1, *coords2)
     lon1, lat1 = np.deg2rad(coords1)
     lon2, lat2 = np.deg2rad(coords2)
     return np.arctan2(
@@ -1546,6 +2361,13 @@ def compute_new_coords(X1: np.ndarray,
     (np.ndarray, np.ndarray) or (float, float)
         new particle coordinates in degrees
     """
+    if _is_scalar(X1, Y1, D, B):
+        Y2 = _new_lat_kernel(Y1, D, B)
+        return _new_lon_kernel(X1, Y1, D, B, Y2), Y2
+    lat_ufunc = _jit_ufunc(_new_lat_kernel, 3)
+    if lat_ufunc is not None:
+        Y2 = lat_ufunc(Y1, D, B)
+        return _jit_ufunc(_new_lon_kernel, 5)(X1, Y1, D, B, Y2), Y2
     X1 = np.deg2rad(X1)
     Y1 = np.deg2rad(Y1)
     d = D / 6378100.
@@ -1586,6 +2408,10 @@ def compute_back_bearing(bearings: np.ndarray) -> np.ndarray:
     -------
     np.ndarray
     """
-    bool_ = bearings <= 0.
-    return bool_*(bearings + np.pi) + (1-bool_)*(bearings - np.pi)
+    if _is_scalar(bearings):
+        return _back_bearing_kernel(bearings)
+    ufunc = _jit_ufunc(_back_bearing_kernel, 1)
+    if ufunc is not None:
+        return ufunc(bearings)
+    return bearings + np.where(bearings <= 0., np.pi, -np.pi)
 
@@ -29,6 +29,9 @@ logger = get_logger(name = "main_background_update")
 
 GMAX_FEED = GmaxFeed()
 
+# longest the driver thread sleeps between checks of the jobs queue, seconds
+MAX_IDLE = 300
+
 
 class BackgroundGmaxUpdater(Scheduler):
 
@@ -39,6 +42,8 @@ class BackgroundGmaxUpdater(Scheduler):
         logger.info("Initiating BackgroundGmaxUpdater - {0}".format(self))
         self.active = True
         self.requests = requests
+        # set by terminate, to wake the driver thread from its sleep
+        self._stopped = threading.Event()
         
         # list background jobs here
         self.every(2).hours.do(self._updater)
@@ -66,15 +71,18 @@ class BackgroundGmaxUpdater(Scheduler):
             )
 
     def driver(self):
-        # driver thread for the background scheduled tasks
+        # driver thread for the background scheduled tasks, sleeps until the
+        # next job is due, checking back at least every MAX_IDLE seconds
         while self.active:
             self.run_pending()
-            systime.sleep(30)
+            idle = self.idle_seconds
+            self._stopped.wait(30 if idle is None else max(1, min(idle, MAX_IDLE)))
 
     def terminate(self) -> None:
         # clears jobs from Scheduler
         self.active = False
         self.clear()
+        self._stopped.set()
 
 
 if __name__ == "__main__":